@@ -1,10 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, send_file
 from flask_cors import CORS
 import pickle
+import hashlib
+import io
+import json
 import pandas as pd
 import numpy as np
 import os
+import queue
 import sqlite3
+import atexit
+import pstats
+import time
+
+from cache import LRUCache
+from colikes import colike_scores
+from catalog import MATCH_COLIKE_WEIGHT, MATCH_TEXT_WEIGHT, CatalogIndex, normalize_restaurants, sample_positions, top_k
+from database import ConnectionPool, WriteBehindQueue
+from metrics import CONTENT_TYPE, Histogram, render_metrics
+from profiler import PROFILE_HEADER, RequestProfiler
+from profiles import DEFAULT_USER, ProfileStore
+from reasoning import nutrient_masks, render
+from reloader import CatalogReloader
+from search import SearchIndex
+from similar import SimilarityIndex
+from db_setup import init_db, load_excel_to_db, create_model_pickle, create_snapshot
+from snapshot import current_version_path, load_snapshot
+from tfidf import TfidfIndex
+from serializers import (
+    HEALTHY_OPTION_FIELDS, MATCH_FIELDS, RECOMMEND_FIELDS, SEARCH_FIELDS, SUGGESTION_FIELDS,
+    TEST_CARD_FIELDS,
+    frame_columns, json_response, serialize_rows
+)
 
 app = Flask(__name__)
 CORS(app)
@@ -12,6 +39,9 @@ CORS(app)
 # Load the model
 MODEL_PATH = 'food_model.pkl'
 
+# Columnar catalog snapshot, memory-mapped in preference to the pickle
+SNAPSHOT_PATH = 'food_catalog'
+
 # Path to SQLite database
 DB_PATH = 'food_app.db'
 
@@ -28,37 +58,131 @@ meal_values = {
     'protein': 20  # grams
 }
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def compute_reasoning(row):
-    high = []
-    low = []
-
-    for k in ['calories', 'total_fat', 'saturated_fat', 'trans_fat', 'cholesterol', 'sodium', 'sugar']:
-        if row[k] > meal_values[k]:
-            high.append(k.replace('_', ' '))
-
-    for k in ['dietary_fiber', 'protein']:
-        if row[k] < meal_values[k] * 0.7:
-            low.append(k.replace('_', ' '))
-
-    if not high and not low:
-        return "Balanced"
+# Long-lived connections shared across requests
+db_pool = ConnectionPool(DB_PATH)
+
+# Preference profiles, updated as each batch of votes is written
+profile_store = ProfileStore()
+
+# Preference votes are buffered and group-committed in the background
+vote_queue = WriteBehindQueue(db_pool, profile_store.record_votes)
+atexit.register(vote_queue.close)
+
+# Largest number of votes accepted by /api/preferences/batch
+MAX_VOTE_BATCH = 1000
+
+# Largest number of queries accepted by /api/recommend/batch
+MAX_RECOMMEND_BATCH = 25
+
+# Largest k accepted by /api/similar
+MAX_SIMILAR = 100
+
+# Largest limit accepted by /api/search
+MAX_SEARCH_RESULTS = 50
+
+# Longest user_id accepted from clients
+MAX_USER_ID_LENGTH = 64
+
+# Longest a read waits for queued votes to be written before it answers
+# from the last committed profile instead
+VOTE_FLUSH_TIMEOUT = 0.5
+
+# Latency of every request by route template, and of the stages inside the
+# heavier endpoints, exported at /api/metrics
+request_latency = Histogram(
+    'foodtauh_request_duration_seconds', 'Request latency by route.', ('route', 'method', 'status')
+)
+stage_latency = Histogram(
+    'foodtauh_stage_duration_seconds', 'Time spent in each stage of an endpoint.', ('endpoint', 'stage')
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Route templates keep the label set bounded, unknown paths share one
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        request_latency.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+    return response
+
+# Opt-in request profiling: PROFILE_SAMPLE_RATE=N profiles one in N requests,
+# and with PROFILE_TOKEN set, requests sending it in X-Profile-Token are
+# profiled too. The newest PROFILE_KEEP profiles are kept in PROFILE_DIR.
+request_profiler = RequestProfiler(
+    os.environ.get('PROFILE_DIR', 'profiles'),
+    sample_rate=int(os.environ.get('PROFILE_SAMPLE_RATE', '0')),
+    token=os.environ.get('PROFILE_TOKEN'),
+    keep=int(os.environ.get('PROFILE_KEEP', '50'))
+)
+
+def start_profile():
+    # Fetching profiles sends the token too, don't let that evict real ones
+    if request.endpoint in ('list_profiles', 'download_profile'):
+        return
+    profile = request_profiler.start(request.headers.get(PROFILE_HEADER))
+    if profile is not None:
+        g.profile = profile
+
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        response.headers['X-Profile-Name'] = request_profiler.finish(profile, request.method, route)
+    return response
+
+def discard_profile(exception):
+    # Requests that raised never reach after_request
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+
+# Without sampling or a token the hooks aren't installed at all
+if request_profiler.enabled:
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(discard_profile)
 
-    parts = []
-    if high:
-        parts.append(f"High: {', '.join(high)}")
-    if low:
-        parts.append(f"Low: {', '.join(low)}")
-
-    return " | ".join(parts)
+def get_db_connection():
+    """Connection for the current request, returned to the pool on teardown"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db_connection(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+def load_model(from_db=False):
+    # Build straight from the foods table when it is newer than the files
+    if from_db:
+        conn = sqlite3.connect(DB_PATH)
+        df = pd.read_sql_query("SELECT * FROM foods", conn)
+        conn.close()
+        return {
+            'index': CatalogIndex.from_frame(df),
+            'version': 'db'
+        }
+    
+    # Map the columnar snapshot read-only so workers share its pages
+    if current_version_path(SNAPSHOT_PATH) is not None:
+        columns, manifest = load_snapshot(SNAPSHOT_PATH)
+        return {
+            'index': CatalogIndex(columns),
+            'text': TfidfIndex.load(manifest['path']),
+            'version': manifest['version']
+        }
 
-def load_model():
+    # Fall back to unpickling the whole frame, keeping only its compacted columns
     with open(MODEL_PATH, 'rb') as f:
-        return pickle.load(f)
+        package = pickle.load(f)
+    package['index'] = CatalogIndex.from_frame(package.pop('data'))
+    return package
 
 def recommend_food(df, hunger, health, restaurant="any", count=5):
     # Calorie ranges based on hunger level
@@ -98,415 +222,356 @@ def recommend_food(df, hunger, health, restaurant="any", count=5):
     recommendations = []
     if not filtered.empty:
         results = filtered.sample(min(count, len(filtered)))
-        for _, row in results.iterrows():
-            recommendations.append({
-                'id': int(row['id']) if 'id' in row else None,
-                'restaurant': row['restaurant'],
-                'item_name': row['item_name'],
-                'calories': row['calories'],
-                'health_score': float(row['health_score']),
-                'protein': row['protein'],
-                'carbs': row['carbohydrates'],
-                'fat': row['total_fat'],
-                'fiber': row['dietary_fiber'],
-                'sugar': row['sugar'],
-                'sodium': row['sodium'],
-                'reasoning': compute_reasoning(row),
-                'description': row['item_description'] if pd.notna(row['item_description']) else 'No description available.'
-            })
+        positions = np.arange(len(results))
+        columns = frame_columns(results)
+        recommendations = serialize_rows(columns, positions, SUGGESTION_FIELDS)
+        for item, text in zip(recommendations, render(nutrient_masks(columns, meal_values))):
+            item['reasoning'] = text
     return recommendations
 
+# Lookup lists precomputed per catalog: response key -> (CatalogIndex
+# postings attribute, values left out of the list)
+LOOKUPS = {
+    'restaurants': ('restaurants', ()),
+    'protein_types': ('protein_types', ('Unknown',)),
+    'food_types': ('food_types', ('Unknown',)),
+}
+
+def build_lookups(index):
+    """Serialize every lookup list with per-value counts once, keyed by response key
+
+    The ETag is a digest of the body, so it only changes when a reload
+    actually changes the list and every worker hands out the same one.
+    """
+    lookups = {}
+    for key, (attribute, exclude) in LOOKUPS.items():
+        counts = index.value_counts(getattr(index, attribute), exclude)
+        payload = {
+            'success': True,
+            key: [value for value, _ in counts],
+            'counts': dict(counts)
+        }
+        body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        lookups[key] = (body, hashlib.sha1(body).hexdigest()[:20])
+    return lookups
+
+def lookup_response(key):
+    """Serve a precomputed lookup list, answering 304 when the client's copy is current"""
+    if model_package is None:
+        return jsonify({'success': False, 'error': 'Model not loaded'}), 500
+    body, etag = model_package['lookups'][key]
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/api/restaurants', methods=['GET'])
 def get_restaurants():
+    """Get all restaurants in the catalog with their item counts"""
     try:
-        conn = get_db_connection()
-        restaurants = conn.execute('SELECT DISTINCT restaurant FROM foods').fetchall()
-        conn.close()
-        
-        restaurant_list = [r['restaurant'] for r in restaurants]
-        
-        return jsonify({
-            'success': True,
-            'restaurants': restaurant_list
-        })
+        return lookup_response('restaurants')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Candidate positions of recent /api/recommend filter combinations, emptied
+# whenever a new catalog is swapped in
+recommend_cache = LRUCache()
+
+# Number of catalogs loaded so far, reported by /api/health
+catalog_version = 0
+
+def swap_catalog(package):
+    """Atomically replace the in-memory catalog with a freshly built one"""
+    global model_package, catalog_version
+    package['lookups'] = build_lookups(package['index'])
+    package['similar'] = SimilarityIndex(package['index'])
+    package['search'] = SearchIndex(package['index'].columns)
+    if package.get('text') is None:
+        # Snapshots carry a prebuilt TF-IDF index, otherwise only re-vectorize
+        # the items whose text differs from the catalog being replaced
+        previous = model_package.get('text') if model_package else None
+        package['text'] = TfidfIndex.build(package['index'].columns, previous)
+    catalog_version += 1
+    package['catalog_version'] = catalog_version
+    model_package = package
+
 model_package = None
-if os.path.exists(MODEL_PATH):
-    model_package = load_model()
+if current_version_path(SNAPSHOT_PATH) is not None or os.path.exists(MODEL_PATH):
+    swap_catalog(load_model())
+
+# Watch the snapshot, pickle and database and reload the catalog off the
+# request path when they change. Set CATALOG_RELOAD_INTERVAL=0 to disable.
+CATALOG_RELOAD_INTERVAL = float(os.environ.get('CATALOG_RELOAD_INTERVAL', '2'))
+catalog_reloader = CatalogReloader(SNAPSHOT_PATH, MODEL_PATH, DB_PATH, load_model, swap_catalog,
+                                   interval=CATALOG_RELOAD_INTERVAL)
+if CATALOG_RELOAD_INTERVAL > 0:
+    catalog_reloader.start()
 
 
 
 @app.route('/api/test-cards', methods=['GET'])
 def get_test_cards():
     try:
-        conn = get_db_connection()
-        
-        # Get a balanced selection of items across different health scores
-        query = '''
-        SELECT 
-            id, item_name, restaurant, calories, protein,
-            carbohydrates, total_fat, health_score,
-            protein_type, food_type, reasoning
-        FROM foods 
-        WHERE health_score BETWEEN ? AND ?
-        ORDER BY RANDOM()
-        LIMIT ?
-        '''
+        if model_package is None:
+            return jsonify({'success': False, 'error': 'Model not loaded'}), 500
+        
+        index = model_package['index']
+        user_id = request_user_id()
         
+        # Optionally skip items this user has already rated
+        excluded = None
+        if request.args.get('exclude_rated', 'false').lower() in ('1', 'true', 'yes'):
+            vote_queue.flush(timeout=VOTE_FLUSH_TIMEOUT)
+            profile = profile_store.get(get_db_connection(), user_id)
+            excluded = set(index.positions_of(profile.rated).tolist())
+        
+        # Get a balanced selection of items across different health scores,
+        # drawing from precomputed health bands of the catalog
         test_cards = []
         # Get 5 items from different health score ranges
         ranges = [(7, 10, 2), (4, 6.9, 2), (1, 3.9, 1)]  # (min, max, count)
         
         for min_score, max_score, count in ranges:
-            items = conn.execute(query, (min_score, max_score, count)).fetchall()
-            for item in items:
-                test_cards.append({
-                    'id': item['id'],
-                    'name': item['item_name'],
-                    'restaurant': item['restaurant'],
-                    'calories': int(item['calories']),
-                    'protein': float(item['protein']),
-                    'carbs': float(item['carbohydrates']),
-                    'fat': float(item['total_fat']),
-                    'health_score': float(item['health_score']),
-                    'protein_type': item['protein_type'],
-                    'food_type': item['food_type']
-                })
+            band = index.health_band(min_score, max_score)
+            positions = sample_positions(band, count, excluded)
+            test_cards.extend(serialize_rows(index.columns, positions, TEST_CARD_FIELDS))
         
-        conn.close()
         return jsonify({'success': True, 'cards': test_cards})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def request_meal_values(data):
+    """Default meal targets overridden by any numeric ones in the request's meal_values
+
+    Returns None when the request has none. Raises ValueError for unknown
+    nutrients or non-numeric targets.
+    """
+    overrides = data.get('meal_values')
+    if overrides is None:
+        return None
+    if not isinstance(overrides, dict):
+        raise ValueError('meal_values must be an object')
+    for nutrient, value in overrides.items():
+        if nutrient not in meal_values:
+            raise ValueError(f"Unknown nutrient '{nutrient}' in meal_values")
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f"meal_values['{nutrient}'] must be a number")
+    return {**meal_values, **overrides}
+
+def request_user_id(data=None):
+    """user_id from the JSON body or query string, the default user if neither has one
+
+    Raises ValueError for ids that aren't short non-empty strings.
+    """
+    user_id = None
+    if isinstance(data, dict):
+        user_id = data.get('user_id')
+    if user_id is None:
+        user_id = request.args.get('user_id')
+    if user_id is None:
+        return DEFAULT_USER
+    if not isinstance(user_id, str) or not user_id.strip() or len(user_id) > MAX_USER_ID_LENGTH:
+        raise ValueError(f'user_id must be a non-empty string of at most {MAX_USER_ID_LENGTH} characters')
+    return user_id
+
+def parse_vote(vote, user_id):
+    """(user_id, food_id, is_liked) row for a vote payload, or None if it has no food_id"""
+    food_id = vote.get('food_id')
+    if food_id is None:
+        return None
+    if not isinstance(food_id, int) or isinstance(food_id, bool) or food_id <= 0:
+        raise ValueError('food_id must be a positive integer')
+    return (user_id, food_id, 1 if vote.get('is_liked', False) else 0)
+
 @app.route('/api/preferences', methods=['POST'])
 def save_preference():
     try:
         data = request.get_json()
-        food_id = data.get('food_id')
-        is_liked = data.get('is_liked', False)
+        user_id = request_user_id(data)
+        row = parse_vote(data, user_id)
         
-        if not food_id:
+        if row is None:
             return jsonify({'success': False, 'error': 'Missing food_id'}), 400
         
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO preferences (food_id, is_liked) VALUES (?, ?)',
-            (food_id, 1 if is_liked else 0)
-        )
-        conn.commit()
-        conn.close()
+        vote_queue.submit([row])
         
         return jsonify({'success': True})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except queue.Full:
+        return jsonify({'success': False, 'error': 'Too many pending votes, try again'}), 503
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/protein-types', methods=['GET'])
-def get_protein_types():
-    """Get all unique protein types in the database"""
+@app.route('/api/preferences/batch', methods=['POST'])
+def save_preferences_batch():
+    """Save many swipes in one request"""
     try:
-        conn = get_db_connection()
-        types = conn.execute('SELECT DISTINCT protein_type FROM foods WHERE protein_type IS NOT NULL AND protein_type != "Unknown"').fetchall()
-        conn.close()
+        data = request.get_json()
+        votes = data.get('votes')
         
-        protein_types = [t['protein_type'] for t in types if t['protein_type']]
+        if not isinstance(votes, list) or not votes:
+            return jsonify({'success': False, 'error': 'Missing votes'}), 400
+        if len(votes) > MAX_VOTE_BATCH:
+            return jsonify({'success': False, 'error': f'At most {MAX_VOTE_BATCH} votes per batch'}), 400
         
-        return jsonify({
-            'success': True,
-            'protein_types': protein_types
-        })
+        user_id = request_user_id(data)
+        rows = [parse_vote(vote, user_id) if isinstance(vote, dict) else None for vote in votes]
+        if None in rows:
+            return jsonify({'success': False, 'error': 'Every vote needs a food_id'}), 400
+        
+        vote_queue.submit(rows)
+        
+        return jsonify({'success': True, 'saved': len(rows)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except queue.Full:
+        return jsonify({'success': False, 'error': 'Too many pending votes, try again'}), 503
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/protein-types', methods=['GET'])
+def get_protein_types():
+    """Get all known protein types in the catalog with their item counts"""
+    try:
+        return lookup_response('protein_types')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/food-types', methods=['GET'])
 def get_food_types():
-    """Get all unique food types in the database"""
+    """Get all known food types in the catalog with their item counts"""
     try:
-        conn = get_db_connection()
-        types = conn.execute('SELECT DISTINCT food_type FROM foods WHERE food_type IS NOT NULL AND food_type != "Unknown"').fetchall()
-        conn.close()
-        
-        food_types = [t['food_type'] for t in types if t['food_type']]
-        
-        return jsonify({
-            'success': True,
-            'food_types': food_types
-        })
+        return lookup_response('food_types')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Calorie ranges based on hunger level
+HUNGER_RANGES = {
+    "all": (0, 2000),
+    "low": (0, 400),
+    "medium": (401, 999),
+    "high": (1000, 2000)
+}
+
+# Health score ranges
+HEALTH_RANGES = {
+    "all": (1, 10),
+    "low": (1, 4.9),
+    "medium": (5, 7.9),
+    "high": (8, 10)
+}
+
+def recommend_query(package, data, endpoint='recommend', masks=None):
+    """Recommendations for one /api/recommend request body
+    
+    Queries resolved with the same `masks` dict share their filter masks.
+    """
+    hunger = data.get('hunger', 'medium')
+    health = data.get('health', 'medium')
+    restaurant = data.get('restaurant', 'any')
+    count = data.get('count', 5)
+    food_type = data.get('food_type', 'any')  # Food type filter
+    protein_type = data.get('protein_type', 'any')  # Protein type filter
+    seed = data.get('seed')  # Optional seed for reproducible sampling
+    targets = request_meal_values(data)  # Optional per-request meal targets
+    
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise ValueError('seed must be a non-negative integer')
+    
+    # Get the filter index from the model
+    index = package['index']
+    
+    # Apply hunger and health filters first
+    low_cal, high_cal = HUNGER_RANGES[hunger]
+    low_score, high_score = HEALTH_RANGES[health]
+    
+    # Resolve the filters and, if we filtered too aggressively, the
+    # relaxation tiers (protein type, then food type, then top N by
+    # health score) against the precomputed index in one pass. Repeated
+    # filter combinations reuse the candidates from the cache.
+    restaurants = normalize_restaurants(restaurant)
+    key = (hunger, health, restaurants, food_type, protein_type, count)
+    positions = recommend_cache.get_or_compute(key, package['catalog_version'], lambda: index.resolve(
+        low_cal, high_cal, low_score, high_score,
+        restaurant="any" if restaurants is None else restaurants, food_type=food_type,
+        protein_type=protein_type, count=count,
+        stage=lambda name: stage_latency.time(endpoint, name), masks=masks
+    ))
+    
+    # Sample or take top N results
+    with stage_latency.time(endpoint, 'sample'):
+        if len(positions) > count:
+            rng = np.random if seed is None else np.random.RandomState(seed)
+            positions = rng.choice(positions, count, replace=False)
+    
+    with stage_latency.time(endpoint, 'serialize'):
+        # Format the results
+        recommendations = serialize_rows(index.columns, positions, RECOMMEND_FIELDS)
+        
+        # Custom meal targets replace the stored reasoning with one against them
+        if targets is not None:
+            texts = render(nutrient_masks(index.columns, targets, positions))
+            for item, text in zip(recommendations, texts):
+                item['reasoning'] = text
+    
+    return recommendations
+
 # Update the recommend endpoint
 @app.route('/api/recommend', methods=['POST'])
 def recommend():
     try:
         if model_package is None:
             return jsonify({'success': False, 'error': 'Model not loaded'}), 500
-            
-        data = request.get_json()
-        hunger = data.get('hunger', 'medium')
-        health = data.get('health', 'medium')
-        restaurant = data.get('restaurant', 'any')
-        count = data.get('count', 5)
-        food_type = data.get('food_type', 'any')  # Food type filter
-        protein_type = data.get('protein_type', 'any')  # Protein type filter
-        
-        # Get dataframe from the model
-        df = model_package['data']
-        
-        # Apply hunger and health filters first
-        hunger_map = {
-            "all": (0, 2000),
-            "low": (0, 400),
-            "medium": (401, 999),
-            "high": (1000, 2000)
-        }
         
-        health_map = {
-            "all": (1, 10),
-            "low": (1, 4.9),
-            "medium": (5, 7.9),
-            "high": (8, 10)
-        }
-        
-        low_cal, high_cal = hunger_map[hunger]
-        low_score, high_score = health_map[health]
-        
-        # Filter based on calories and health score
-        filtered = df[
-            (df['calories'] >= low_cal) & (df['calories'] <= high_cal) &
-            (df['health_score'] >= low_score) & (df['health_score'] <= high_score)
-        ]
-        
-        # Filter by restaurant
-        if restaurant != "any":
-            if isinstance(restaurant, list):
-                # Handle multiple restaurants
-                filtered = filtered[filtered['restaurant'].isin(restaurant)]
-            else:
-                # Handle single restaurant
-                filtered = filtered[filtered['restaurant'].str.lower() == restaurant.lower()]
-        
-        # Filter by food type
-        if food_type != "any":
-            filtered = filtered[filtered['food_type'] == food_type]
-        
-        # Filter by protein type
-        if protein_type != "any":
-            filtered = filtered[filtered['protein_type'] == protein_type]
-        
-        # If we filtered too aggressively, relax the constraints
-        if len(filtered) < count:
-            # Try relaxing protein type requirement
-            if protein_type != "any":
-                # Keep food type filter but remove protein type filter
-                relaxed = df[
-                    (df['calories'] >= low_cal) & (df['calories'] <= high_cal) &
-                    (df['health_score'] >= low_score) & (df['health_score'] <= high_score)
-                ]
-                
-                if restaurant != "any":
-                    if isinstance(restaurant, list):
-                        relaxed = relaxed[relaxed['restaurant'].isin(restaurant)]
-                    else:
-                        relaxed = relaxed[relaxed['restaurant'].str.lower() == restaurant.lower()]
-                
-                if food_type != "any":
-                    relaxed = relaxed[relaxed['food_type'] == food_type]
-                
-                # Add previously filtered results first
-                combined = pd.concat([filtered, relaxed])
-                # Remove duplicates
-                filtered = combined.drop_duplicates(subset=['id', 'restaurant', 'item_name'])
-        
-        # If still not enough, try relaxing food type
-        if len(filtered) < count and food_type != "any":
-            # Keep protein type filter but remove food type filter
-            relaxed = df[
-                (df['calories'] >= low_cal) & (df['calories'] <= high_cal) &
-                (df['health_score'] >= low_score) & (df['health_score'] <= high_score)
-            ]
-            
-            if restaurant != "any":
-                if isinstance(restaurant, list):
-                    relaxed = relaxed[relaxed['restaurant'].isin(restaurant)]
-                else:
-                    relaxed = relaxed[relaxed['restaurant'].str.lower() == restaurant.lower()]
-            
-            if protein_type != "any":
-                relaxed = relaxed[relaxed['protein_type'] == protein_type]
-            
-            # Add previously filtered results first
-            combined = pd.concat([filtered, relaxed])
-            # Remove duplicates
-            filtered = combined.drop_duplicates(subset=['id', 'restaurant', 'item_name'])
-        
-        # If we still don't have enough, just get the top N by health score
-        if len(filtered) < count:
-            # Fall back to just hunger and health filters
-            filtered = df[
-                (df['calories'] >= low_cal) & (df['calories'] <= high_cal) &
-                (df['health_score'] >= low_score) & (df['health_score'] <= high_score)
-            ]
-            
-            if restaurant != "any":
-                if isinstance(restaurant, list):
-                    filtered = filtered[filtered['restaurant'].isin(restaurant)]
-                else:
-                    filtered = filtered[filtered['restaurant'].str.lower() == restaurant.lower()]
-            
-            # Sort by health score
-            filtered = filtered.sort_values('health_score', ascending=False)
-        
-        # Sample or take top N results
-        if len(filtered) > count:
-            results = filtered.sample(count)
-        else:
-            results = filtered
-        
-        # Format the results
-        recommendations = []
-        for _, row in results.iterrows():
-            recommendations.append({
-                'id': int(row['id']) if 'id' in row else None,
-                'restaurant': row['restaurant'],
-                'item_name': row['item_name'],
-                'calories': int(row['calories']),
-                'health_score': float(row['health_score']),
-                'protein': float(row['protein']),
-                'carbs': float(row['carbohydrates']),
-                'fat': float(row['total_fat']),
-                'fiber': float(row['dietary_fiber']),
-                'sugar': float(row['sugar']),
-                'sodium': float(row['sodium']),
-                'protein_type': row.get('protein_type', 'Unknown'),
-                'food_type': row.get('food_type', 'Unknown'),
-                'reasoning': row['reasoning'] if pd.notna(row['reasoning']) else 'No nutritional analysis available.'
-            })
-        
-        return jsonify({
+        return json_response({
             'success': True, 
-            'recommendations': recommendations
+            'recommendations': recommend_query(model_package, request.get_json())
         })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-import sqlite3
-import pandas as pd
-import pickle
-import os
-
-def init_db():
-    """Create the initial database structure"""
-    conn = sqlite3.connect('food_app.db')
-    c = conn.cursor()
-    
-    # Create foods table with columns for the classification data
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS foods (
-        id INTEGER PRIMARY KEY,
-        food_category TEXT,
-        restaurant TEXT,
-        item_name TEXT,
-        item_description TEXT,
-        calories INTEGER,
-        total_fat REAL,
-        saturated_fat REAL,
-        trans_fat REAL,
-        cholesterol REAL,
-        sodium REAL,
-        carbohydrates REAL,
-        dietary_fiber REAL,
-        sugar REAL,
-        protein REAL,
-        health_score REAL,
-        reasoning TEXT,
-        protein_type TEXT,
-        food_type TEXT
-    )
-    ''')
-    
-    # Create preferences table
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS preferences (
-        id INTEGER PRIMARY KEY,
-        food_id INTEGER,
-        is_liked INTEGER,
-        FOREIGN KEY (food_id) REFERENCES foods (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("Database created successfully.")
-
-def load_excel_to_db(excel_path):
-    """Load data from Excel to SQLite using the existing classification columns"""
-    # Load the Excel file
-    print(f"Loading data from {excel_path}...")
-    df = pd.read_excel(excel_path)
-    
-    # Connect to SQLite database
-    conn = sqlite3.connect('food_app.db')
-    
-    # Insert data into foods table, including the classification columns
-    print("Inserting data into database...")
-    for _, row in df.iterrows():
-        conn.execute('''
-        INSERT INTO foods (
-            food_category, restaurant, item_name, item_description, 
-            calories, total_fat, saturated_fat, trans_fat, 
-            cholesterol, sodium, carbohydrates, dietary_fiber, 
-            sugar, protein, health_score, reasoning,
-            protein_type, food_type
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            row.get('food_category', ''),
-            row.get('restaurant', ''),
-            row.get('item_name', ''),
-            row.get('item_description', ''),
-            row.get('calories', 0),
-            row.get('total_fat', 0),
-            row.get('saturated_fat', 0),
-            row.get('trans_fat', 0),
-            row.get('cholesterol', 0),
-            row.get('sodium', 0),
-            row.get('carbohydrates', 0),
-            row.get('dietary_fiber', 0),
-            row.get('sugar', 0),
-            row.get('protein', 0),
-            row.get('health_score', 0),
-            row.get('reasoning', ''),
-            row.get('protein_type', 'Unknown'),  # Use the existing classification
-            row.get('food_type', 'Unknown'),     # Use the existing classification
-        ))
-    
-    # Commit and close
-    conn.commit()
-    conn.close()
-    print("Data loaded successfully.")
-
-def create_model_pickle():
-    """Create a pickle file for the model"""
-    # Connect to SQLite database
-    conn = sqlite3.connect('food_app.db')
-    
-    # Load data into DataFrame
-    df = pd.read_sql_query("SELECT * FROM foods", conn)
-    conn.close()
-    
-    # Create the model package
-    model_package = {
-        'data': df,
-        'version': '1.0'
-    }
-    
-    # Save as pickle
-    with open('food_model.pkl', 'wb') as f:
-        pickle.dump(model_package, f)
-    
-    print("Model pickle file created successfully.")
+@app.route('/api/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """Run many /api/recommend queries in one request, computing shared filter masks once"""
+    try:
+        if model_package is None:
+            return jsonify({'success': False, 'error': 'Model not loaded'}), 500
+        
+        data = request.get_json()
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not isinstance(queries, list) or not queries:
+            return jsonify({'success': False, 'error': 'queries must be a non-empty list'}), 400
+        if len(queries) > MAX_RECOMMEND_BATCH:
+            return jsonify({'success': False, 'error': f'At most {MAX_RECOMMEND_BATCH} queries per batch'}), 400
+        
+        # One catalog and one set of masks for the whole batch
+        package = model_package
+        masks = {}
+        results = []
+        for position, query in enumerate(queries):
+            if not isinstance(query, dict):
+                raise ValueError(f'Query {position} must be an object')
+            try:
+                recommendations = recommend_query(package, query, 'recommend_batch', masks)
+            except KeyError as e:
+                raise ValueError(f'Query {position}: unknown value {e}')
+            except ValueError as e:
+                raise ValueError(f'Query {position}: {e}')
+            results.append({'recommendations': recommendations})
+        
+        return json_response({
+            'success': True,
+            'results': results
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 if __name__ == "__main__":
     # Initialize the database
@@ -518,8 +583,9 @@ if __name__ == "__main__":
         # Load data from Excel to SQLite (including the classification data)
         load_excel_to_db(excel_path)
         
-        # Create the model pickle
+        # Create the model pickle and catalog snapshot
         create_model_pickle()
+        create_snapshot()
     else:
         print(f"Excel file '{excel_path}' not found. Please place it in the same directory.")
         
@@ -527,46 +593,27 @@ if __name__ == "__main__":
 @app.route('/api/matches', methods=['GET'])
 def get_matches():
     try:
-        conn = get_db_connection()
-        
-        # Get liked and disliked food IDs
-        liked = conn.execute('SELECT food_id FROM preferences WHERE is_liked = 1').fetchall()
-        disliked = conn.execute('SELECT food_id FROM preferences WHERE is_liked = 0').fetchall()
+        user_id = request_user_id()
         
-        conn.close()
-        
-        liked_ids = [item['food_id'] for item in liked]
-        disliked_ids = [item['food_id'] for item in disliked]
+        with stage_latency.time('matches', 'db_read'):
+            # Count votes still waiting in the write-behind queue, unless the
+            # writer is stuck, then go with the last committed profile
+            vote_queue.flush(timeout=VOTE_FLUSH_TIMEOUT)
+            conn = get_db_connection()
+            
+            # Get this user's incrementally maintained preference profile
+            profile = profile_store.get(conn, user_id)
         
         # If we don't have any preferences yet, return health-based recommendations
-        if not liked_ids:
+        if not profile.liked:
             if model_package is None:
                 return jsonify({'success': False, 'error': 'Model not loaded'}), 500
                 
             # Return some healthy options
-            df = model_package['data']
-            healthy_options = df.sort_values('health_score', ascending=False).head(10)
-            
-            matches = []
-            for _, item in healthy_options.iterrows():
-                matches.append({
-                    'id': int(item['id']) if 'id' in item else None,
-                    'restaurant': item['restaurant'],
-                    'item_name': item['item_name'],
-                    'calories': int(item['calories']),
-                    'health_score': float(item['health_score']),
-                    'protein': float(item['protein']),
-                    'carbs': float(item['carbohydrates']),
-                    'fat': float(item['total_fat']),
-                    'fiber': float(item['dietary_fiber']),
-                    'protein_type': item.get('protein_type', 'Unknown'),
-                    'protein_confidence': float(item.get('protein_confidence', 0.0)),
-                    'food_type': item.get('food_type', 'Unknown'),
-                    'food_type_confidence': float(item.get('food_type_confidence', 0.0)),
-                    'reasoning': item['reasoning'] if pd.notna(item['reasoning']) else 'No nutritional analysis available.'
-                })
+            index = model_package['index']
+            matches = serialize_rows(index.columns, index.healthiest(10), HEALTHY_OPTION_FIELDS)
                 
-            return jsonify({
+            return json_response({
                 'success': True,
                 'matches': matches,
                 'message': 'No preferences recorded yet. Showing healthy options.'
@@ -576,101 +623,201 @@ def get_matches():
         if model_package is None:
             return jsonify({'success': False, 'error': 'Model not loaded'}), 500
             
-        df = model_package['data'].copy()
-        
-        # Calculate average nutritional values of liked items
-        liked_items = df[df['id'].isin(liked_ids)]
+        package = model_package
+        index = package['index']
         
-        if liked_items.empty:
+        # Averages only cover liked items found in the catalog
+        if profile.liked_count == 0:
             return jsonify({'success': False, 'error': 'Liked items not found in database'}), 500
-            
-        # Calculate averages of nutritional values
-        avg_calories = liked_items['calories'].mean()
-        avg_protein = liked_items['protein'].mean()
-        avg_fat = liked_items['total_fat'].mean()
-        avg_carbs = liked_items['carbohydrates'].mean()
-        avg_health = liked_items['health_score'].mean()
-        
-        # Get preferred food types and protein types from liked items
-        preferred_food_types = liked_items['food_type'].value_counts().index.tolist()
-        preferred_protein_types = liked_items['protein_type'].value_counts().index.tolist()
         
         # Only consider items that haven't been rated yet
-        rated_ids = liked_ids + disliked_ids
-        unrated_items = df[~df['id'].isin(rated_ids)].copy()
+        unrated = np.flatnonzero(~index.id_mask(profile.rated))
         
-        if unrated_items.empty:
+        if len(unrated) == 0:
             return jsonify({
                 'success': True,
                 'matches': [],
                 'message': 'You have already rated all available items!'
             })
         
-        # Calculate similarity score for each unrated item
-        def calculate_similarity(row):
-            cal_sim = 1 - min(abs(row['calories'] - avg_calories) / 1000, 1)
-            pro_sim = 1 - min(abs(row['protein'] - avg_protein) / 50, 1)
-            fat_sim = 1 - min(abs(row['total_fat'] - avg_fat) / 70, 1)
-            carb_sim = 1 - min(abs(row['carbohydrates'] - avg_carbs) / 100, 1)
-            health_sim = 1 - min(abs(row['health_score'] - avg_health) / 10, 1)
+        with stage_latency.time('matches', 'scoring'):
+            # Score every unrated item against the profile in one array pass
+            scores = index.match_scores(profile.averages(), profile.liked_values(), unrated)
             
-            # Category bonus - if this item is from a category user liked
-            cat_bonus = 0.3 if row['food_category'] in liked_items['food_category'].values else 0
-            
-            # Restaurant bonus - if this item is from a restaurant user liked
-            rest_bonus = 0.2 if row['restaurant'] in liked_items['restaurant'].values else 0
-            
-            # Food type bonus - prefer items with the same food type
-            food_type_match = 0.3 if row['food_type'] in preferred_food_types else 0
-            
-            # Protein type bonus - prefer items with the same protein type
-            protein_type_match = 0.25 if row['protein_type'] in preferred_protein_types else 0
-            
-            # Calculate weighted similarity score
-            return (cal_sim * 0.1) + (pro_sim * 0.15) + (fat_sim * 0.1) + \
-                   (carb_sim * 0.1) + (health_sim * 0.1) + cat_bonus + rest_bonus + \
-                   food_type_match + protein_type_match
-        
-        # Apply similarity calculation
-        unrated_items['match_score'] = unrated_items.apply(calculate_similarity, axis=1)
+            # Blend in how close each item's name and description are to the liked items'
+            text_scores = package['text'].similarity(index.positions_of(profile.liked))
+            scores += MATCH_TEXT_WEIGHT * text_scores[unrated]
+        
+        # Blend in items other users liked alongside this user's likes
+        with stage_latency.time('matches', 'colike_read'):
+            food_ids, colikes = colike_scores(conn, profile.profile_id)
+        with stage_latency.time('matches', 'scoring_colikes'):
+            colike_positions = index.id_positions(food_ids)
+            collaborative = np.zeros(index.size)
+            found = colike_positions >= 0
+            collaborative[colike_positions[found]] = colikes[found]
+            collaborative = collaborative[unrated]
+            if collaborative.max() > 0:
+                scores += MATCH_COLIKE_WEIGHT * collaborative / collaborative.max()
         
         # Get top matches
-        top_matches = unrated_items.sort_values('match_score', ascending=False).head(10)
-        
-        # Format the results
-        matches = []
-        for _, item in top_matches.iterrows():
-            matches.append({
-                'id': int(item['id']) if 'id' in item else None,
-                'restaurant': item['restaurant'],
-                'item_name': item['item_name'],
-                'calories': int(item['calories']),
-                'health_score': float(item['health_score']),
-                'protein': float(item['protein']),
-                'carbs': float(item['carbohydrates']),
-                'fat': float(item['total_fat']),
-                'fiber': float(item['dietary_fiber']),
-                'sugar': float(item['sugar']),
-                'sodium': float(item['sodium']),
-                'match_score': round(float(item['match_score']) * 100, 1),
-                'protein_type': item.get('protein_type', 'Unknown'),
-                'protein_confidence': float(item.get('protein_confidence', 0.0)),
-                'food_type': item.get('food_type', 'Unknown'),
-                'food_type_confidence': float(item.get('food_type_confidence', 0.0)),
-                'reasoning': item['reasoning'] if pd.notna(item['reasoning']) else 'No nutritional analysis available.'
+        with stage_latency.time('matches', 'top_k'):
+            top = top_k(scores, 10)
+        
+        with stage_latency.time('matches', 'serialize'):
+            # Format the results
+            matches = serialize_rows(index.columns, unrated[top], MATCH_FIELDS)
+            for item, score in zip(matches, scores[top].tolist()):
+                item['match_score'] = round(score * 100, 1)
+                
+            return json_response({
+                'success': True,
+                'matches': matches
             })
-            
-        return jsonify({
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/similar/<int:food_id>', methods=['GET'])
+def get_similar(food_id):
+    """Get the k items closest in nutrition to a food, optionally within restaurants or a food type"""
+    try:
+        if model_package is None:
+            return jsonify({'success': False, 'error': 'Model not loaded'}), 500
+        
+        k = request.args.get('k', '10')
+        if not k.isdigit() or not 1 <= int(k) <= MAX_SIMILAR:
+            return jsonify({'success': False, 'error': f'k must be between 1 and {MAX_SIMILAR}'}), 400
+        
+        package = model_package
+        index = package['index']
+        positions = index.positions_of([food_id])
+        if len(positions) == 0:
+            return jsonify({'success': False, 'error': 'Food not found'}), 404
+        
+        # Filters are applied inside the neighbour search, not afterwards
+        mask = None
+        restaurants = request.args.getlist('restaurant')
+        food_type = request.args.get('food_type', 'any')
+        for filter_mask in (index.restaurant_mask(restaurants or "any"), index.food_type_mask(food_type)):
+            if filter_mask is not None:
+                mask = filter_mask if mask is None else mask & filter_mask
+        
+        neighbours, distances = package['similar'].nearest(positions[0], int(k), mask)
+        
+        similar = serialize_rows(index.columns, neighbours, MATCH_FIELDS)
+        for item, distance in zip(similar, distances.tolist()):
+            item['distance'] = round(distance, 4)
+        
+        return json_response({
             'success': True,
-            'matches': matches
+            'item': serialize_rows(index.columns, positions[:1], MATCH_FIELDS)[0],
+            'similar': similar
         })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_foods():
+    """Search item names and descriptions, treating the last word as a prefix while typing"""
+    try:
+        if model_package is None:
+            return jsonify({'success': False, 'error': 'Model not loaded'}), 500
+        
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({'success': False, 'error': 'Missing q'}), 400
         
+        limit = request.args.get('limit', '10')
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_SEARCH_RESULTS:
+            return jsonify({'success': False, 'error': f'limit must be between 1 and {MAX_SEARCH_RESULTS}'}), 400
+        
+        # A trailing space means the last word is finished
+        package = model_package
+        positions, scores, completions = package['search'].search(
+            query, int(limit), prefix=not query[-1].isspace()
+        )
+        
+        results = serialize_rows(package['index'].columns, positions, SEARCH_FIELDS)
+        for item, score in zip(results, scores.tolist()):
+            item['score'] = round(score, 3)
+        
+        return json_response({
+            'success': True,
+            'results': results,
+            'suggestions': completions
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy'})
+    package = model_package
+    return jsonify({
+        'status': 'healthy',
+        'catalog_version': package['catalog_version'] if package else None,
+        'catalog_items': package['index'].size if package else 0
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms and catalog, cache and queue counters in Prometheus text format"""
+    package = model_package
+    samples = [
+        ('foodtauh_catalog_items', 'gauge', 'Items in the loaded catalog.',
+         package['index'].size if package else 0),
+        ('foodtauh_catalog_version', 'gauge', 'Number of catalogs loaded since startup.', catalog_version),
+        ('foodtauh_recommend_cache_hits_total', 'counter', 'Recommend filter lookups served from the cache.',
+         recommend_cache.hits),
+        ('foodtauh_recommend_cache_misses_total', 'counter', 'Recommend filter lookups that were resolved.',
+         recommend_cache.misses),
+        ('foodtauh_recommend_cache_entries', 'gauge', 'Filter combinations held in the recommend cache.',
+         len(recommend_cache)),
+        ('foodtauh_profile_cache_hits_total', 'counter', 'Profile reads served without reloading.',
+         profile_store.hits),
+        ('foodtauh_profile_cache_misses_total', 'counter', 'Profile reads that loaded from the database.',
+         profile_store.misses),
+        ('foodtauh_profile_cache_entries', 'gauge', 'Preference profiles held in memory.', len(profile_store)),
+        ('foodtauh_vote_queue_pending', 'gauge', 'Votes waiting for the next group commit.', vote_queue.pending),
+        ('foodtauh_vote_queue_failed_total', 'counter', 'Votes dropped by failed group commits.', vote_queue.failed),
+    ]
+    return Response(render_metrics([request_latency, stage_latency], samples), content_type=CONTENT_TYPE)
+
+def profiles_forbidden():
+    if not request_profiler.authorized(request.headers.get(PROFILE_HEADER)):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    return None
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Stored request profiles, newest first. Requires the profiling token."""
+    forbidden = profiles_forbidden()
+    if forbidden:
+        return forbidden
+    return jsonify({'success': True, 'profiles': request_profiler.list()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """A stored profile in pstats format, or with ?format=text as a cumulative-time report"""
+    forbidden = profiles_forbidden()
+    if forbidden:
+        return forbidden
+    
+    path = request_profiler.path(name)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    
+    if request.args.get('format') == 'text':
+        limit = request.args.get('limit', '50')
+        if not limit.isdigit():
+            return jsonify({'success': False, 'error': 'limit must be a non-negative integer'}), 400
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats('cumulative').print_stats(int(limit))
+        return Response(report.getvalue(), mimetype='text/plain')
+    
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Compare two benchmark result files and flag latency regressions
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json [--threshold 0.1]
+
+Exits with status 1 if any endpoint's p95 latency got worse by more than
+the threshold (and by more than --min-ms, to ignore timer noise on very
+fast endpoints).
+"""
+import argparse
+import json
+import sys
+
+
+def change(before, after):
+    if not before:
+        return None
+    return (after - before) / before
+
+
+def compare(baseline, candidate, threshold, min_ms):
+    """Print a side-by-side table and return the regressed (size, endpoint) pairs"""
+    regressions = []
+    for size, result in candidate['sizes'].items():
+        previous = baseline['sizes'].get(size)
+        if previous is None:
+            print(f'Size {size}: no baseline')
+            continue
+
+        print(f"\nSize {size}  (baseline {baseline['meta'].get('revision')}, "
+              f"candidate {candidate['meta'].get('revision')})")
+        print(f"{'endpoint':<36} {'p50 ms':>19} {'p95 ms':>19} {'req/s':>17}")
+        for name, stats in result['endpoints'].items():
+            old = previous['endpoints'].get(name)
+            if old is None:
+                print(f'{name:<36} new endpoint')
+                continue
+
+            p95_change = change(old['p95_ms'], stats['p95_ms'])
+            regressed = (
+                p95_change is not None and p95_change > threshold and
+                stats['p95_ms'] - old['p95_ms'] > min_ms
+            )
+            if regressed:
+                regressions.append((size, name))
+            print(
+                f"{name:<36} {old['p50_ms']:>8.3f} -> {stats['p50_ms']:<8.3f} "
+                f"{old['p95_ms']:>8.3f} -> {stats['p95_ms']:<8.3f} "
+                f"{old['throughput']:>7} -> {stats['throughput']:<7}"
+                f"{'  REGRESSION' if regressed else ''}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative p95 increase')
+    parser.add_argument('--min-ms', type=float, default=0.05, help='ignore p95 increases smaller than this')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = compare(baseline, candidate, args.threshold, args.min_ms)
+    if regressions:
+        print(f'\n{len(regressions)} regression(s) above {args.threshold:.0%}')
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
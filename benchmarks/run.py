@@ -0,0 +1,266 @@
+"""Benchmark every API endpoint against synthetic catalogs of several sizes
+
+Usage:
+    python benchmarks/run.py --sizes 1000 100000 1000000 --output results.json
+    python benchmarks/compare.py baseline.json results.json
+
+Each size runs in a fresh process and scratch directory: a catalog is
+synthesized from classifiedDataset.csv, loaded with db_setup.py, snapshotted,
+and the app is imported against it. Synthetic users then vote through the
+API, and each endpoint is called through Flask's test client. Latencies
+include the test client and JSON encoding but no network.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PATH = os.path.join(ROOT, 'classifiedDataset.csv')
+DEFAULT_SIZES = [1000, 100000, 1000000]
+
+
+def latency_stats(latencies, errors, elapsed):
+    """Throughput and latency percentiles of one endpoint's calls"""
+    ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def scenarios(client, rng, catalog, users):
+    """Request builders keyed by endpoint name, each returning test client kwargs"""
+    ids, restaurants, food_types, protein_types, words = catalog
+    etag = client.get('/api/restaurants').headers.get('ETag')
+
+    def recommend():
+        body = {
+            'hunger': rng.choice(['low', 'medium', 'high', 'all']),
+            'health': rng.choice(['low', 'medium', 'high', 'all']),
+            'restaurant': rng.choice(['any', rng.choice(restaurants), rng.sample(restaurants, 2)]),
+            'food_type': rng.choice(['any'] + food_types),
+            'protein_type': rng.choice(['any'] + protein_types),
+            'count': rng.choice([5, 10]),
+        }
+        return {'path': '/api/recommend', 'method': 'POST', 'json': body}
+
+    def recommend_batch():
+        # A dashboard: one row per restaurant at the same hunger and health
+        hunger, health = rng.choice(['low', 'medium', 'high']), rng.choice(['medium', 'high'])
+        queries = [
+            {'hunger': hunger, 'health': health, 'restaurant': name, 'count': 5}
+            for name in rng.sample(restaurants, min(12, len(restaurants)))
+        ]
+        return {'path': '/api/recommend/batch', 'method': 'POST', 'json': {'queries': queries}}
+
+    def vote():
+        body = {'food_id': rng.choice(ids), 'is_liked': rng.random() < 0.6, 'user_id': rng.choice(users)}
+        return {'path': '/api/preferences', 'method': 'POST', 'json': body}
+
+    def vote_batch():
+        votes = [{'food_id': rng.choice(ids), 'is_liked': rng.random() < 0.6} for _ in range(50)]
+        return {'path': '/api/preferences/batch', 'method': 'POST',
+                'json': {'user_id': rng.choice(users), 'votes': votes}}
+
+    def search():
+        word = rng.choice(words)
+        return {'path': '/api/search', 'query_string': {'q': word[:rng.randint(2, len(word))]}}
+
+    return {
+        'GET /api/health': lambda: {'path': '/api/health'},
+        'GET /api/restaurants': lambda: {'path': '/api/restaurants'},
+        'GET /api/restaurants (304)': lambda: {'path': '/api/restaurants', 'headers': {'If-None-Match': etag}},
+        'GET /api/protein-types': lambda: {'path': '/api/protein-types'},
+        'GET /api/food-types': lambda: {'path': '/api/food-types'},
+        'POST /api/recommend': recommend,
+        'POST /api/recommend/batch (12)': recommend_batch,
+        'GET /api/test-cards': lambda: {'path': '/api/test-cards'},
+        'GET /api/test-cards?exclude_rated': lambda: {
+            'path': '/api/test-cards', 'query_string': {'exclude_rated': '1', 'user_id': rng.choice(users)}
+        },
+        'POST /api/preferences': vote,
+        'POST /api/preferences/batch': vote_batch,
+        'GET /api/matches': lambda: {'path': '/api/matches', 'query_string': {'user_id': rng.choice(users)}},
+        'GET /api/similar': lambda: {'path': f'/api/similar/{rng.choice(ids)}', 'query_string': {'k': 10}},
+        'GET /api/search': search,
+        'GET /api/metrics': lambda: {'path': '/api/metrics'},
+    }
+
+
+def run_worker(args):
+    """Build one synthetic catalog in the current directory and benchmark it"""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+    os.environ['CATALOG_RELOAD_INTERVAL'] = '0'
+    from synthetic import load_source, synthesize_catalog, synthesize_votes
+    import db_setup
+
+    setup = {}
+    started = time.perf_counter()
+    catalog = synthesize_catalog(load_source(SOURCE_PATH), args.size, seed=args.seed)
+    catalog.to_csv('menu.tsv', sep='\t', index=False)
+    setup['generate_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    db_setup.init_db()
+    db_setup.load_to_db('menu.tsv')
+    setup['load_db_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    db_setup.create_snapshot()
+    setup['snapshot_s'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    import app
+    setup['startup_s'] = round(time.perf_counter() - started, 3)
+
+    client = app.app.test_client()
+    index = app.model_package['index']
+    ids = index.ids.tolist()
+    restaurants = [value for value, _ in index.value_counts(index.restaurants)]
+    food_types = [value for value, _ in index.value_counts(index.food_types, ('Unknown',))]
+    protein_types = [value for value, _ in index.value_counts(index.protein_types, ('Unknown',))]
+    words = [term for term in app.model_package['search'].terms if len(term) > 3 and term.isalpha()]
+
+    # Give every synthetic user a voting history before timing anything
+    started = time.perf_counter()
+    histories = synthesize_votes(ids, args.users, args.votes, seed=args.seed)
+    for user_id, votes in histories.items():
+        for start in range(0, len(votes), app.MAX_VOTE_BATCH):
+            client.post('/api/preferences/batch', json={'user_id': user_id, 'votes': votes[start:start + app.MAX_VOTE_BATCH]})
+    app.vote_queue.flush()
+    setup['votes_s'] = round(time.perf_counter() - started, 3)
+
+    rng = random.Random(args.seed)
+    endpoints = {}
+    for name, build in scenarios(client, rng, (ids, restaurants, food_types, protein_types, words), list(histories)).items():
+        for _ in range(args.warmup):
+            client.open(**build())
+
+        latencies = []
+        errors = 0
+        elapsed = 0.0
+        for _ in range(args.requests):
+            request = build()
+            started = time.perf_counter()
+            response = client.open(**request)
+            took = time.perf_counter() - started
+            elapsed += took
+            latencies.append(took)
+            if response.status_code >= 400:
+                errors += 1
+        endpoints[name] = latency_stats(latencies, errors, elapsed)
+        print(f"{args.size:>9} {name:<36} p50 {endpoints[name]['p50_ms']:>9.3f} ms  "
+              f"p99 {endpoints[name]['p99_ms']:>9.3f} ms  {endpoints[name]['throughput']:>9} req/s", flush=True)
+
+    app.vote_queue.close()
+    result = {
+        'size': index.size,
+        'users': args.users,
+        'votes_per_user': args.votes,
+        'setup': setup,
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'endpoints': endpoints,
+    }
+    with open(args.result, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Benchmark each size in its own process and write the combined results"""
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'requests': args.requests,
+        },
+        'sizes': {},
+    }
+
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f'bench-{size}-', dir=args.workdir)
+        result_path = os.path.join(workdir, 'result.json')
+        command = [
+            sys.executable, os.path.abspath(__file__), '--worker',
+            '--size', str(size), '--requests', str(args.requests), '--warmup', str(args.warmup),
+            '--users', str(args.users), '--votes', str(args.votes), '--seed', str(args.seed),
+            '--result', result_path,
+        ]
+        try:
+            # Setup chatter goes to the log, the per-endpoint lines are echoed
+            with open(os.path.join(workdir, 'worker.log'), 'w') as log:
+                process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.PIPE, stderr=log, text=True)
+                for line in process.stdout:
+                    if line.startswith(f'{size:>9} '):
+                        print(line, end='', flush=True)
+                        log.write(line)
+                    else:
+                        log.write(line)
+                if process.wait() != 0:
+                    print(f'Size {size} failed, see {log.name}', file=sys.stderr)
+                    args.keep = True
+                    continue
+            with open(result_path) as f:
+                results['sizes'][str(size)] = json.load(f)
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='catalog sizes to benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests per endpoint first')
+    parser.add_argument('--users', type=int, default=50, help='synthetic users with a voting history')
+    parser.add_argument('--votes', type=int, default=40, help='votes in each user history')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--workdir', default=None, help='where to create scratch directories')
+    parser.add_argument('--keep', action='store_true', help='keep scratch directories')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
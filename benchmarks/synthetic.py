@@ -0,0 +1,60 @@
+"""Synthetic catalogs and preference histories shaped like the real dataset"""
+import numpy as np
+import pandas as pd
+
+from db_setup import FOOD_COLUMNS, TEXT_COLUMNS, iter_source_rows
+
+NUMERIC_COLUMNS = [column for column in FOOD_COLUMNS if column not in TEXT_COLUMNS]
+
+# Spread of the multiplicative noise applied to every nutrient
+JITTER = 0.1
+
+
+def load_source(path):
+    """The real menu file as a frame with the loader's columns"""
+    df = pd.DataFrame(list(iter_source_rows(path)))
+    df = df[[column for column in FOOD_COLUMNS if column in df.columns]]
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+    return df.dropna(subset=['item_name']).reset_index(drop=True)
+
+
+def synthesize_catalog(source, size, seed=0):
+    """A catalog of `size` items drawn from the real one
+
+    Each synthetic item copies a random real item, so restaurants, types
+    and nutrients stay jointly distributed as in the source, then scales
+    each nutrient by a little noise. Names get a serial number so the
+    natural key stays unique.
+    """
+    rng = np.random.default_rng(seed)
+    df = source.iloc[rng.integers(0, len(source), size)].reset_index(drop=True)
+
+    for column in NUMERIC_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy(dtype=np.float64) * rng.normal(1, JITTER, size)
+        if column == 'health_score':
+            df[column] = values.clip(1, 10).round(1)
+        elif column == 'calories':
+            df[column] = values.clip(0).round()
+        else:
+            df[column] = values.clip(0).round(1)
+
+    df['item_name'] = df['item_name'].astype(str) + ' #' + pd.Series(np.arange(size)).astype(str)
+    return df
+
+
+def synthesize_votes(food_ids, users, votes_per_user, like_rate=0.6, seed=0):
+    """{user_id: [vote, ...]} with each user rating random items"""
+    rng = np.random.default_rng(seed)
+    histories = {}
+    for user in range(users):
+        picks = rng.choice(food_ids, votes_per_user)
+        liked = rng.random(votes_per_user) < like_rate
+        histories[f'bench-{user}'] = [
+            {'food_id': int(food_id), 'is_liked': bool(is_liked)}
+            for food_id, is_liked in zip(picks, liked)
+        ]
+    return histories
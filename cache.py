@@ -0,0 +1,73 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache tied to one catalog version
+
+    Bounded both by entry count and by total weight (the sum of len() of
+    the cached values), so a few huge candidate arrays can't push memory
+    past `max_weight`. Looking up with a newer catalog version than the
+    cached entries were computed for empties the cache first. Requests
+    still running against an older catalog compute without touching it.
+    """
+
+    def __init__(self, max_entries=512, max_weight=4_000_000):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+    def get_or_compute(self, key, version, compute):
+        """Cached value for key under the given catalog version, computing it on a miss"""
+        with self._lock:
+            if self.version is not None and version < self.version:
+                self.misses += 1
+                stale = True
+            else:
+                stale = False
+                if version != self.version:
+                    self._entries.clear()
+                    self._weight = 0
+                    self.version = version
+        if stale:
+            return compute()
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        # Compute outside the lock, concurrent misses on one key just race
+        value = compute()
+        weight = len(value)
+        if weight > self.max_weight:
+            return value
+
+        with self._lock:
+            if version != self.version:
+                return value
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._weight -= len(previous)
+            self._entries[key] = value
+            self._weight += weight
+            while len(self._entries) > self.max_entries or self._weight > self.max_weight:
+                _, evicted = self._entries.popitem(last=False)
+                self._weight -= len(evicted)
+        return value
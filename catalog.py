@@ -0,0 +1,380 @@
+import random
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from snapshot import EncodedColumn, compact_columns
+
+# Nutrients compared by get_matches(): (column, distance scale, weight)
+MATCH_NUTRIENTS = [
+    ('calories', 1000, 0.1),
+    ('protein', 50, 0.15),
+    ('total_fat', 70, 0.1),
+    ('carbohydrates', 100, 0.1),
+    ('health_score', 10, 0.1),
+]
+
+# Bonus for sharing a value with any liked item: (column, bonus)
+MATCH_BONUSES = [
+    ('food_category', 0.3),
+    ('restaurant', 0.2),
+    ('food_type', 0.3),
+    ('protein_type', 0.25),
+]
+
+# Weight of the name/description TF-IDF similarity to the liked items
+MATCH_TEXT_WEIGHT = 0.3
+
+# Weight of the item-item co-like score, scaled so the best candidate gets 1
+MATCH_COLIKE_WEIGHT = 0.3
+
+
+def _untimed(name):
+    return nullcontext()
+
+
+def column_codes(column):
+    """Integer codes and distinct values of a column, with -1 marking missing values"""
+    if isinstance(column, EncodedColumn):
+        return np.asarray(column.codes), column.uniques
+    return pd.factorize(column, sort=False)
+
+
+def as_column_bound(value, values):
+    """A filter bound rounded like a float32 column's values, so 4.9 still matches a stored 4.9"""
+    if values.dtype.kind == 'f':
+        return values.dtype.type(value)
+    return value
+
+
+def widen(values):
+    """A numeric column as float64, float32 values read as the shortest decimal that round-trips"""
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return values.astype(str).astype(np.float64)
+    return values.astype(np.float64)
+
+
+def build_postings(column):
+    """Map each distinct value of a column to the sorted row positions holding it"""
+    codes, uniques = column_codes(column)
+    order = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+    # Missing values get code -1 and sort to the front, skip past them
+    start = int((codes < 0).sum())
+    postings = {}
+    for value, size in zip(uniques, counts):
+        postings[value] = order[start:start + size]
+        start += size
+    return postings
+
+
+def lowercase_postings(postings):
+    """Merge posting lists whose values are equal ignoring case"""
+    merged = {}
+    for value, positions in postings.items():
+        merged.setdefault(value.lower(), []).append(positions)
+    return {
+        value: parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+        for value, parts in merged.items()
+    }
+
+
+def normalize_restaurants(restaurant):
+    """Sorted, lowercased tuple of restaurant names, or None for "any"
+
+    A single name and a one-element list select the same rows, so both
+    normalize to the same tuple and can share a cache entry.
+    """
+    if isinstance(restaurant, str):
+        if restaurant == "any":
+            return None
+        restaurant = [restaurant]
+    return tuple(sorted({name.lower() for name in restaurant}))
+
+
+def sample_positions(candidates, count, excluded=None, rng=random):
+    """Draw up to `count` distinct entries of `candidates` uniformly at random
+
+    Runs in O(count) expected time however large the candidate array is.
+    `excluded` is a set of positions to skip. Skipped draws are retried a
+    bounded number of times before falling back to filtering the
+    candidates, which only happens when most of them are excluded.
+    """
+    total = len(candidates)
+    count = min(count, total)
+    if count <= 0:
+        return np.empty(0, dtype=np.intp)
+    if not excluded:
+        return candidates[rng.sample(range(total), count)]
+
+    chosen = []
+    tried = set()
+    attempts = 0
+    while len(chosen) < count and attempts < count * 8 and len(tried) < total:
+        attempts += 1
+        i = rng.randrange(total)
+        if i in tried:
+            continue
+        tried.add(i)
+        if int(candidates[i]) not in excluded:
+            chosen.append(int(candidates[i]))
+
+    if len(chosen) < count:
+        skip = np.fromiter(excluded | set(chosen), dtype=np.intp)
+        remaining = candidates[~np.isin(candidates, skip)]
+        picks = rng.sample(range(len(remaining)), min(count - len(chosen), len(remaining)))
+        chosen.extend(remaining[picks].tolist())
+
+    return np.asarray(chosen, dtype=np.intp)
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, highest first, ties broken by lower position
+
+    Uses a partial selection so picking a handful of rows is linear in the
+    number of scores rather than a full sort.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    # The k-th highest score; everything above it is in, ties are cut by position
+    threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    above = np.flatnonzero(scores > threshold)
+    tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+    chosen = np.concatenate([above, tied])
+
+    return chosen[np.lexsort((chosen, -scores[chosen]))]
+
+
+class CatalogIndex:
+    """Filter index over the catalog columns, built once when the model loads
+
+    `columns` maps column names to NumPy arrays or EncodedColumns, which
+    may be memory-mapped from a catalog snapshot.
+    """
+
+    def __init__(self, columns):
+        # Column arrays used to serialize responses without touching a frame
+        self.columns = columns
+        self.ids = np.asarray(columns['id'], dtype=np.int64)
+        self.size = len(self.ids)
+
+        # Sorted calorie and health score arrays for range lookups, kept in
+        # the columns' own (possibly narrowed) dtypes
+        calories = np.asarray(columns['calories'])
+        self.calorie_order = np.argsort(calories, kind='stable')
+        self.calories_sorted = calories[self.calorie_order]
+
+        health = np.asarray(columns['health_score'])
+        self.health_order = np.argsort(health, kind='stable')
+        self.health_sorted = health[self.health_order]
+
+        # Ranking from healthiest to least healthy, ties broken by position
+        self.health_rank = np.lexsort((np.arange(self.size), -health))
+
+        # Sorted ids for id -> position lookups
+        self.id_order = np.argsort(self.ids, kind='stable')
+        self.ids_sorted = self.ids[self.id_order]
+
+        # Posting lists for the equality filters
+        self.restaurants = build_postings(columns['restaurant'])
+        self.restaurants_lower = lowercase_postings(self.restaurants)
+        self.food_types = build_postings(columns['food_type'])
+        self.protein_types = build_postings(columns['protein_type'])
+
+        # Nutrient arrays and categorical codes for match scoring
+        self.match_values = {
+            column: widen(columns[column])
+            for column, _, _ in MATCH_NUTRIENTS
+        }
+        self.match_codes = {}
+        self.match_code_of = {}
+        for column, _ in MATCH_BONUSES:
+            codes, uniques = column_codes(columns[column])
+            self.match_codes[column] = codes
+            self.match_code_of[column] = {value: code for code, value in enumerate(uniques)}
+
+    @classmethod
+    def from_frame(cls, df):
+        """Index a catalog DataFrame"""
+        return cls(compact_columns(df))
+
+    def _range_mask(self, order, values_sorted, low, high):
+        start = np.searchsorted(values_sorted, as_column_bound(low, values_sorted), side='left')
+        stop = np.searchsorted(values_sorted, as_column_bound(high, values_sorted), side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        mask[order[start:stop]] = True
+        return mask
+
+    def _postings_mask(self, postings, values):
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            positions = postings.get(value)
+            if positions is not None:
+                mask[positions] = True
+        return mask
+
+    def range_mask(self, low_cal, high_cal, low_score, high_score):
+        """Rows whose calories and health score fall inside both inclusive ranges"""
+        return (
+            self._range_mask(self.calorie_order, self.calories_sorted, low_cal, high_cal) &
+            self._range_mask(self.health_order, self.health_sorted, low_score, high_score)
+        )
+
+    def restaurant_mask(self, restaurant):
+        """Rows matching a restaurant name or list of names, ignoring case"""
+        names = normalize_restaurants(restaurant)
+        if names is None:
+            return None
+        return self._postings_mask(self.restaurants_lower, names)
+
+    def food_type_mask(self, food_type):
+        if food_type == "any":
+            return None
+        return self._postings_mask(self.food_types, [food_type])
+
+    def protein_type_mask(self, protein_type):
+        if protein_type == "any":
+            return None
+        return self._postings_mask(self.protein_types, [protein_type])
+
+    @staticmethod
+    def value_counts(postings, exclude=()):
+        """(value, row count) pairs of a posting index in first-seen order, skipping empty values"""
+        return [
+            (value, len(positions)) for value, positions in postings.items()
+            if value and value not in exclude
+        ]
+
+    def health_band(self, low, high):
+        """Positions with low <= health_score <= high, as a slice of the sorted order"""
+        start = np.searchsorted(self.health_sorted, as_column_bound(low, self.health_sorted), side='left')
+        stop = np.searchsorted(self.health_sorted, as_column_bound(high, self.health_sorted), side='right')
+        return self.health_order[start:stop]
+
+    def positions_of(self, ids):
+        """Positions of the given ids, skipping ids that aren't in the catalog"""
+        ids = np.asarray(list(ids), dtype=self.ids.dtype)
+        found = np.searchsorted(self.ids_sorted, ids)
+        found = found[found < self.size]
+        positions = self.id_order[found]
+        return positions[np.isin(self.ids[positions], ids)]
+
+    def id_positions(self, ids):
+        """Position of each id in order, -1 for ids that aren't in the catalog"""
+        ids = np.asarray(ids, dtype=self.ids.dtype)
+        if self.size == 0:
+            return np.full(len(ids), -1, dtype=np.intp)
+        found = np.minimum(np.searchsorted(self.ids_sorted, ids), self.size - 1)
+        positions = self.id_order[found]
+        return np.where(self.ids[positions] == ids, positions, -1)
+
+    def id_mask(self, ids):
+        """Rows whose id is in the given collection"""
+        return np.isin(self.ids, np.asarray(list(ids), dtype=self.ids.dtype))
+
+    def match_scores(self, averages, liked_values, candidates):
+        """Similarity of each candidate row to a preference profile, as used by get_matches()
+
+        `averages` maps each nutrient to its mean over liked items and
+        `liked_values` maps each category column to the values liked items
+        have. Nutrient similarity is measured against the averages, and each
+        categorical bonus applies when the candidate shares a liked value.
+        """
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for column, scale, weight in MATCH_NUTRIENTS:
+            values = self.match_values[column]
+            similarity = 1 - np.minimum(np.abs(values[candidates] - averages[column]) / scale, 1)
+            scores += similarity * weight
+
+        for column, bonus in MATCH_BONUSES:
+            code_of = self.match_code_of[column]
+            liked_codes = [code_of[value] for value in liked_values[column] if value in code_of]
+            matched = np.isin(self.match_codes[column][candidates], liked_codes)
+            scores += np.where(matched, bonus, 0)
+        return scores
+
+    def by_health_desc(self, mask):
+        """Positions of the masked rows ordered from highest to lowest health score"""
+        return self.health_rank[mask[self.health_rank]]
+
+    def healthiest(self, k):
+        """Positions of the k rows with the highest health score"""
+        return self.health_rank[:k]
+
+    def resolve(self, low_cal, high_cal, low_score, high_score,
+                restaurant="any", food_type="any", protein_type="any", count=5, stage=None, masks=None):
+        """Resolve a recommend query and its relaxation tiers in a single pass.
+
+        Returns row positions in the order the tiers contributed them. The
+        tiers are, in turn: every filter, without protein type, without
+        food type, and finally hunger/health/restaurant only ranked by
+        health score. `stage(name)`, if given, returns a context manager
+        timing each step. Queries resolved with the same `masks` dict
+        compute each predicate mask they have in common only once.
+        """
+        stage = stage or _untimed
+        masks = {} if masks is None else masks
+
+        def shared(key, compute):
+            if key not in masks:
+                masks[key] = compute()
+            return masks[key]
+
+        with stage('filter'):
+            bounds = (low_cal, high_cal, low_score, high_score)
+            names = normalize_restaurants(restaurant)
+
+            def base_mask():
+                mask = shared(('range', bounds), lambda: self.range_mask(*bounds))
+                restaurant_mask = shared(('restaurant', names), lambda: self.restaurant_mask(restaurant))
+                return mask if restaurant_mask is None else mask & restaurant_mask
+
+            # Shared masks are never modified in place
+            base = shared(('base', bounds, names), base_mask)
+            food_mask = shared(('food_type', food_type), lambda: self.food_type_mask(food_type))
+            protein_mask = shared(('protein_type', protein_type), lambda: self.protein_type_mask(protein_type))
+
+            selected = shared(
+                ('selected', bounds, names, food_type, protein_type),
+                lambda: self._intersect(base, food_mask, protein_mask)
+            )
+            positions = np.flatnonzero(selected)
+
+        # Relax protein type, keeping the food type filter
+        if len(positions) < count and protein_mask is not None:
+            with stage('relax_protein_type'):
+                relaxed = shared(('selected', bounds, names, food_type, 'any'),
+                                 lambda: self._intersect(base, food_mask))
+                positions, selected = self._extend(positions, selected, relaxed)
+
+        # Relax food type, keeping the protein type filter
+        if len(positions) < count and food_mask is not None:
+            with stage('relax_food_type'):
+                relaxed = shared(('selected', bounds, names, 'any', protein_type),
+                                 lambda: self._intersect(base, protein_mask))
+                positions, selected = self._extend(positions, selected, relaxed)
+
+        # Fall back to hunger, health and restaurant ranked by health score
+        if len(positions) < count:
+            with stage('relax_health_rank'):
+                positions = self.by_health_desc(base)
+
+        return positions
+
+    @staticmethod
+    def _intersect(mask, *others):
+        for other in others:
+            if other is not None:
+                mask = mask & other
+        return mask
+
+    @staticmethod
+    def _extend(positions, selected, relaxed):
+        # Keep earlier tiers first, then append rows only the relaxed tier adds
+        added = np.flatnonzero(relaxed & ~selected)
+        return np.concatenate([positions, added]), selected | relaxed
@@ -0,0 +1,135 @@
+import json
+
+import numpy as np
+
+# Neighbours of each liked item that contribute to a user's scores
+COLIKE_NEIGHBOURS = 50
+
+# A user's most recent likes that seed their scores, and that each new like
+# is paired with, so neither cost grows with a heavy user's history
+COLIKE_SEEDS = 50
+COLIKE_PAIRS = 50
+
+
+def create_colike_tables(conn):
+    """Create the item-item co-like tables, backfilling them from liked profile items"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'co_likes'"
+    ).fetchone()
+
+    # Number of users who liked both items within COLIKE_PAIRS likes of each
+    # other in their history, stored in both directions
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS co_likes (
+        food_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (food_id, other_id)
+    ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_co_likes_rank
+    ON co_likes (food_id, count DESC, other_id)
+    ''')
+
+    # Number of users who liked each item
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS item_likes (
+        food_id INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+    )
+    ''')
+
+    if exists:
+        return
+    conn.execute('''
+    INSERT INTO item_likes (food_id, count)
+    SELECT food_id, COUNT(*) FROM profile_items WHERE liked = 1 GROUP BY food_id
+    ''')
+    conn.execute('''
+    WITH ranked AS (
+        SELECT profile_id, food_id,
+               ROW_NUMBER() OVER (PARTITION BY profile_id ORDER BY revision, rowid) AS n
+        FROM profile_items WHERE liked = 1
+    ),
+    pairs AS (
+        -- Each like paired with the likes just before it, as record_like() does
+        SELECT a.food_id AS food_id, b.food_id AS other_id
+        FROM ranked AS a JOIN ranked AS b
+        ON b.profile_id = a.profile_id AND b.n < a.n AND b.n >= a.n - ?
+    )
+    INSERT INTO co_likes (food_id, other_id, count)
+    SELECT food_id, other_id, COUNT(*) FROM (
+        SELECT food_id, other_id FROM pairs
+        UNION ALL
+        SELECT other_id, food_id FROM pairs
+    )
+    GROUP BY food_id, other_id
+    ''', (COLIKE_PAIRS,))
+
+
+def record_like(conn, profile_id, food_id, pairs=COLIKE_PAIRS):
+    """Fold a user's first like of an item into the co-like counts
+
+    Pairs the item with the user's `pairs` most recently rated likes, so
+    the cost per vote is bounded however many items the user has liked.
+    """
+    conn.execute('''
+    INSERT INTO item_likes (food_id, count) VALUES (?, 1)
+    ON CONFLICT (food_id) DO UPDATE SET count = count + 1
+    ''', (food_id,))
+
+    others = [
+        row[0] for row in conn.execute(
+            '''
+            SELECT food_id FROM profile_items WHERE profile_id = ? AND liked = 1 AND food_id != ?
+            ORDER BY revision DESC, rowid DESC LIMIT ?
+            ''',
+            (profile_id, food_id, pairs)
+        )
+    ]
+    pairs = [(food_id, other) for other in others] + [(other, food_id) for other in others]
+    conn.executemany('''
+    INSERT INTO co_likes (food_id, other_id, count) VALUES (?, ?, 1)
+    ON CONFLICT (food_id, other_id) DO UPDATE SET count = count + 1
+    ''', pairs)
+
+
+def colike_scores(conn, profile_id, neighbours=COLIKE_NEIGHBOURS, seeds=COLIKE_SEEDS):
+    """Collaborative score of items co-liked with a user's liked items
+
+    Each of the user's `seeds` most recently rated likes contributes the
+    cosine similarity co_likes / sqrt(likes_a * likes_b) of its
+    `neighbours` most co-liked items. One query reads them all: each seed's
+    neighbours come off idx_co_likes_rank with their like counts, packed
+    into a JSON array. Returns (food_ids, scores) with scores summed per item.
+    """
+    rows = conn.execute('''
+    WITH seeds AS (
+        SELECT food_id FROM profile_items WHERE profile_id = ? AND liked = 1
+        ORDER BY revision DESC, rowid DESC LIMIT ?
+    )
+    SELECT COALESCE(item_likes.count, 1), (
+        SELECT json_group_array(json_array(top.other_id, top.count, COALESCE(other.count, 1)))
+        FROM (
+            SELECT other_id, count FROM co_likes WHERE food_id = seeds.food_id
+            ORDER BY count DESC, other_id LIMIT ?
+        ) AS top LEFT JOIN item_likes AS other ON other.food_id = top.other_id
+    )
+    FROM seeds LEFT JOIN item_likes ON item_likes.food_id = seeds.food_id
+    ''', (profile_id, seeds, neighbours)).fetchall()
+
+    likes = []
+    entries = []
+    for seed_likes, packed in rows:
+        found = json.loads(packed)
+        likes.extend([seed_likes] * len(found))
+        entries.extend(found)
+    if not entries:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    entries = np.array(entries, dtype=np.int64)
+    other_ids = entries[:, 0]
+    similarity = entries[:, 1] / np.sqrt(np.array(likes, dtype=np.float64) * entries[:, 2])
+    scored_ids, inverse = np.unique(other_ids, return_inverse=True)
+    return scored_ids, np.bincount(inverse, weights=similarity)
@@ -0,0 +1,245 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+
+# Pragmas applied to every pooled connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',       # readers don't block the preference writer
+    'synchronous': 'NORMAL',     # fsync on checkpoint rather than every commit
+    'cache_size': -16000,        # 16 MB page cache per connection
+    'mmap_size': 268435456,      # memory-map up to 256 MB of the database file
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,        # ms to wait on a locked database
+}
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections
+
+    Connections are opened lazily up to `size`, configured once with the
+    pragmas above and then reused, so the sqlite3 statement cache keeps
+    prepared statements warm across requests.
+    """
+
+    def __init__(self, path, size=8, timeout=5.0, pragmas=None, cached_statements=256):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.cached_statements = cached_statements
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name}={value}')
+        return conn
+
+    def acquire(self):
+        """Take an idle connection, opening a new one while under the size limit"""
+        # Connections must not cross a fork, children start with an empty pool
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                open_new = True
+            else:
+                open_new = False
+
+        if open_new:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError('Timed out waiting for a database connection')
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work"""
+        if os.getpid() != self._pid:
+            return
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+
+class WriteBehindQueue:
+    """Buffers row writes and group-commits them from a background thread
+
+    Rows submitted by many requests within `interval` seconds (or up to
+    `batch_size` of them) are handed to `write(conn, rows)` inside a single
+    transaction, so the commit and its fsync are shared. Operational errors
+    (the database is locked, busy or unavailable) say nothing about the
+    rows, so the commit is retried with backoff until it succeeds. Any other
+    error is blamed on the data: the rows are then committed one at a time
+    so only the bad ones are lost.
+    At most `max_pending` rows are held in memory; beyond that submit()
+    waits up to `timeout` seconds for room for all of its rows and then
+    raises queue.Full without queueing any of them.
+    """
+
+    _STOP = object()
+
+    def __init__(self, pool, write, max_pending=10000, batch_size=500, interval=0.005, timeout=1.0,
+                 retry_delay=0.05, max_retry_delay=2.0):
+        self.pool = pool
+        self.write = write
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # Holds one list of rows per submit(), bounded by the pending count
+        self._queue = queue.Queue()
+        self._done = threading.Condition()
+        self._submitted = 0
+        self._written = 0
+        self.failed = 0
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            # Threads don't survive a fork, children start with an empty queue
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def submit(self, rows):
+        """Queue rows for the next group commit, all of them or none"""
+        rows = list(rows)
+        self._ensure_started()
+        with self._done:
+            fits = self._done.wait_for(
+                lambda: self._submitted - self._written + len(rows) <= self.max_pending,
+                timeout=self.timeout
+            )
+            if not fits:
+                raise queue.Full
+            self._submitted += len(rows)
+            self._queue.put(rows)
+
+    @property
+    def pending(self):
+        """Rows submitted but not yet written"""
+        return self._submitted - self._written
+
+    def flush(self, timeout=None):
+        """Wait until every row submitted so far has been written"""
+        with self._done:
+            target = self._submitted
+            return self._done.wait_for(lambda: self._written >= target, timeout=timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is self._STOP:
+                break
+
+            # Collect whatever else arrives within the batching window
+            batch = list(first)
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    rows = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if rows is self._STOP:
+                    stopping = True
+                    break
+                batch.extend(rows)
+
+            self._write(batch)
+
+    def _commit(self, rows):
+        # Keep the rows until the database lets them through
+        delay = self.retry_delay
+        while True:
+            try:
+                conn = self.pool.acquire()
+                try:
+                    with conn:
+                        self.write(conn, rows)
+                finally:
+                    self.pool.release(conn)
+                return
+            except sqlite3.OperationalError as e:
+                print(f'Vote write failed ({e}), retrying in {delay:.2f}s')
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def _write(self, batch):
+        try:
+            self._commit(batch)
+        except Exception:
+            # Retry row by row so one bad row doesn't take the others with it,
+            # and drop the rows that still fail rather than wedge later writes
+            for row in batch:
+                try:
+                    self._commit([row])
+                except Exception:
+                    self.failed += 1
+                    traceback.print_exc()
+
+        with self._done:
+            self._written += len(batch)
+            self._done.notify_all()
+
+    def close(self):
+        """Write everything still queued and stop the writer thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
@@ -1,11 +1,58 @@
+import csv
+import hashlib
+import json
 import sqlite3
 import pandas as pd
 import pickle
 import os
+import sys
+
+from profiles import DEFAULT_USER, create_profile_tables
+from snapshot import write_snapshot
+from tfidf import TfidfIndex
+
+DB_PATH = 'food_app.db'
+
+# Columnar snapshot directory the API memory-maps at startup
+SNAPSHOT_PATH = 'food_catalog'
+
+# Rows per executemany batch, each batch is committed on its own
+CHUNK_SIZE = 1000
+
+# Columns loaded into the foods table and the default used when the
+# source file doesn't have the column at all
+FOOD_COLUMNS = {
+    'food_category': '',
+    'restaurant': '',
+    'item_name': '',
+    'item_description': '',
+    'calories': 0,
+    'total_fat': 0,
+    'saturated_fat': 0,
+    'trans_fat': 0,
+    'cholesterol': 0,
+    'sodium': 0,
+    'carbohydrates': 0,
+    'dietary_fiber': 0,
+    'sugar': 0,
+    'protein': 0,
+    'health_score': 0,
+    'reasoning': '',
+    'protein_type': 'Unknown',  # Use the existing classification
+    'food_type': 'Unknown',     # Use the existing classification
+}
+
+TEXT_COLUMNS = {
+    'food_category', 'restaurant', 'item_name', 'item_description',
+    'reasoning', 'protein_type', 'food_type'
+}
+
+# A menu item is the same item across reloads if these match
+NATURAL_KEY = ('restaurant', 'item_name', 'item_description')
 
 def init_db():
     """Create the initial database structure"""
-    conn = sqlite3.connect('food_app.db')
+    conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     
     # Create foods table with columns for the classification data
@@ -29,75 +76,215 @@ def init_db():
         health_score REAL,
         reasoning TEXT,
         protein_type TEXT,
-        food_type TEXT
+        food_type TEXT,
+        content_hash TEXT
     )
     ''')
     
     # Create preferences table
-    c.execute('''
+    c.execute(f'''
     CREATE TABLE IF NOT EXISTS preferences (
         id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL DEFAULT '{DEFAULT_USER}',
         food_id INTEGER,
         is_liked INTEGER,
         FOREIGN KEY (food_id) REFERENCES foods (id)
     )
     ''')
     
+    migrate_foods(conn)
+    create_profile_tables(conn)
+    
     conn.commit()
     conn.close()
     print("Database created successfully.")
 
-def load_excel_to_db(excel_path):
-    """Load data from Excel to SQLite using the existing classification columns"""
-    # Load the Excel file
-    print(f"Loading data from {excel_path}...")
-    df = pd.read_excel(excel_path)
-    
-    # Connect to SQLite database
-    conn = sqlite3.connect('food_app.db')
-    
-    # Insert data into foods table, including the classification columns
+def migrate_foods(conn):
+    """Bring a foods table from an older version up to the upsert schema"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(foods)')]
+    if 'content_hash' not in columns:
+        conn.execute('ALTER TABLE foods ADD COLUMN content_hash TEXT')
+
+    # Older loaders inserted every row again on each run. Keep the first
+    # copy of each item and point preferences at it before the natural key
+    # becomes unique.
+    key = ', '.join(NATURAL_KEY)
+    conn.execute("UPDATE foods SET item_description = '' WHERE item_description IS NULL")
+    conn.execute(f'''
+    UPDATE preferences SET food_id = (
+        SELECT MIN(keep.id) FROM foods AS keep, foods AS dup
+        WHERE dup.id = preferences.food_id
+        AND keep.restaurant IS dup.restaurant
+        AND keep.item_name IS dup.item_name
+        AND keep.item_description IS dup.item_description
+    )
+    WHERE food_id IN (
+        SELECT id FROM foods WHERE id NOT IN (SELECT MIN(id) FROM foods GROUP BY {key})
+    )
+    ''')
+    conn.execute(f'DELETE FROM foods WHERE id NOT IN (SELECT MIN(id) FROM foods GROUP BY {key})')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_foods_natural_key ON foods ({key})')
+
+def iter_source_rows(path):
+    """Stream rows of a CSV or xlsx menu file as dicts keyed by header"""
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else '' for name in next(rows, ())]
+            for values in rows:
+                yield dict(zip(header, values))
+        finally:
+            workbook.close()
+        return
+
+    with open(path, encoding='utf-8', newline='') as f:
+        dialect = csv.Sniffer().sniff(f.readline(), delimiters=',\t;')
+        f.seek(0)
+        for row in csv.DictReader(f, dialect=dialect):
+            yield row
+
+def normalize_row(raw):
+    """Values for FOOD_COLUMNS from a source row, or None for blank rows
+
+    Raises ValueError naming the column when a numeric cell isn't a number.
+    """
+    values = []
+    for column, default in FOOD_COLUMNS.items():
+        if column not in raw:
+            values.append(default)
+            continue
+
+        value = raw[column]
+        if value is None or (isinstance(value, str) and not value.strip()):
+            # Key columns can't be NULL or every reload would insert again
+            values.append('' if column in NATURAL_KEY else None)
+        elif column in TEXT_COLUMNS:
+            values.append(str(value))
+        else:
+            try:
+                values.append(float(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"{column}: {value!r} is not a number")
+
+    if not any(values[:4]):
+        return None
+    return tuple(values)
+
+def source_key(raw):
+    """Natural key of a source row, as normalize_row() would build it"""
+    return tuple(
+        str(raw[column]) if raw.get(column) is not None and str(raw[column]).strip() else ''
+        for column in NATURAL_KEY
+    )
+
+def content_hash(values):
+    return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+def load_to_db(path, chunk_size=CHUNK_SIZE, prune=False):
+    """Stream a menu file into foods, upserting changed items by natural key
+
+    Rows whose content hash is already stored are skipped, so reloading an
+    updated menu only writes the items that changed. With prune=True,
+    items missing from the file are deleted afterwards. Rows with a
+    non-numeric nutrient are skipped and counted, leaving any stored
+    version of the item in place.
+    """
+    print(f"Loading data from {path}...")
+    conn = sqlite3.connect(DB_PATH)
+
+    columns = list(FOOD_COLUMNS)
+    key_positions = [columns.index(column) for column in NATURAL_KEY]
+    key = ', '.join(NATURAL_KEY)
+    upsert = f'''
+    INSERT INTO foods ({', '.join(columns)}, content_hash)
+    VALUES ({', '.join('?' for _ in range(len(columns) + 1))})
+    ON CONFLICT ({key}) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in columns)},
+        content_hash = excluded.content_hash
+    '''
+
+    # Hashes of what's stored now, keyed by natural key
+    stored = {
+        tuple(row[:-1]): row[-1]
+        for row in conn.execute(f'SELECT {key}, content_hash FROM foods')
+    }
+
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'skipped': 0}
+    seen = set()
+    batch = []
+
+    def flush():
+        with conn:
+            conn.executemany(upsert, batch)
+        batch.clear()
+
     print("Inserting data into database...")
-    for _, row in df.iterrows():
-        conn.execute('''
-        INSERT INTO foods (
-            food_category, restaurant, item_name, item_description, 
-            calories, total_fat, saturated_fat, trans_fat, 
-            cholesterol, sodium, carbohydrates, dietary_fiber, 
-            sugar, protein, health_score, reasoning,
-            protein_type, food_type
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            row.get('food_category', ''),
-            row.get('restaurant', ''),
-            row.get('item_name', ''),
-            row.get('item_description', ''),
-            row.get('calories', 0),
-            row.get('total_fat', 0),
-            row.get('saturated_fat', 0),
-            row.get('trans_fat', 0),
-            row.get('cholesterol', 0),
-            row.get('sodium', 0),
-            row.get('carbohydrates', 0),
-            row.get('dietary_fiber', 0),
-            row.get('sugar', 0),
-            row.get('protein', 0),
-            row.get('health_score', 0),
-            row.get('reasoning', ''),
-            row.get('protein_type', 'Unknown'),  # Use the existing classification
-            row.get('food_type', 'Unknown'),     # Use the existing classification
-        ))
-    
-    # Commit and close
-    conn.commit()
+    for line, raw in enumerate(iter_source_rows(path), start=2):
+        try:
+            values = normalize_row(raw)
+        except ValueError as e:
+            # Don't let --prune delete the stored item because its row is bad
+            seen.add(source_key(raw))
+            stats['skipped'] += 1
+            print(f"Skipping row {line}: {e}")
+            continue
+        if values is None:
+            continue
+
+        item_key = tuple(values[i] for i in key_positions)
+        digest = content_hash(values)
+        seen.add(item_key)
+
+        if item_key not in stored:
+            stats['inserted'] += 1
+        elif stored[item_key] != digest:
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+            continue
+
+        stored[item_key] = digest
+        batch.append(values + (digest,))
+        if len(batch) >= chunk_size:
+            flush()
+
+    if batch:
+        flush()
+
+    if prune:
+        missing = [item_key for item_key in stored if item_key not in seen]
+        key_match = ' AND '.join(f'{column} = ?' for column in NATURAL_KEY)
+        with conn:
+            conn.executemany(f'DELETE FROM foods WHERE {key_match}', missing)
+        stats['deleted'] = len(missing)
+
+    # Bump the catalog version so running servers know to reload
+    if stats['inserted'] or stats['updated'] or stats['deleted']:
+        bump_catalog_version(conn)
+
     conn.close()
-    print("Data loaded successfully.")
+    print(
+        "Data loaded successfully: {inserted} inserted, {updated} updated, "
+        "{unchanged} unchanged, {deleted} deleted, {skipped} skipped.".format(**stats)
+    )
+    return stats
+
+def bump_catalog_version(conn):
+    """Increment the catalog version kept in PRAGMA user_version"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    conn.execute(f'PRAGMA user_version = {version + 1}')
+
+def load_excel_to_db(excel_path):
+    """Load data from Excel to SQLite using the existing classification columns"""
+    return load_to_db(excel_path)
 
 def create_model_pickle():
     """Create a pickle file for the model"""
     # Connect to SQLite database
-    conn = sqlite3.connect('food_app.db')
+    conn = sqlite3.connect(DB_PATH)
     
     # Load data into DataFrame
     df = pd.read_sql_query("SELECT * FROM foods", conn)
@@ -115,17 +302,40 @@ def create_model_pickle():
     
     print("Model pickle file created successfully.")
 
+def create_snapshot():
+    """Write the foods table as a memory-mappable columnar snapshot"""
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query("SELECT * FROM foods", conn)
+    conn.close()
+    
+    def write_tfidf(version_path, previous_path):
+        # Reuse the previous version's term counts for unchanged items
+        previous = TfidfIndex.load(previous_path) if previous_path else None
+        columns = {column: df[column].to_numpy() for column in df.columns}
+        TfidfIndex.build(columns, previous).save(version_path)
+    
+    version = write_snapshot(df, SNAPSHOT_PATH, extra=write_tfidf)
+    print(f"Catalog snapshot v{version} created successfully.")
+
 if __name__ == "__main__":
     # Initialize the database
     init_db()
     
-    # Check if Excel file exists
-    excel_path = 'classifiedDataset.xlsx'
-    if os.path.exists(excel_path):
-        # Load data from Excel to SQLite (including the classification data)
-        load_excel_to_db(excel_path)
+    # Load the menu file given on the command line, or the bundled dataset
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if args:
+        data_path = args[0]
+    elif os.path.exists('classifiedDataset.xlsx'):
+        data_path = 'classifiedDataset.xlsx'
+    else:
+        data_path = 'classifiedDataset.csv'
+    
+    if os.path.exists(data_path):
+        # Load data into SQLite (including the classification data)
+        load_to_db(data_path, prune='--prune' in sys.argv)
         
-        # Create the model pickle
+        # Create the model pickle and catalog snapshot
         create_model_pickle()
+        create_snapshot()
     else:
-        print(f"Excel file '{excel_path}' not found. Please place it in the same directory.")
\ No newline at end of file
+        print(f"Data file '{data_path}' not found. Please place it in the same directory.")
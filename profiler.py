@@ -0,0 +1,109 @@
+import cProfile
+import hmac
+import itertools
+import os
+import re
+import threading
+import time
+
+# Header that asks for a request to be profiled, carrying the shared token
+PROFILE_HEADER = 'X-Profile-Token'
+
+PROFILE_SUFFIX = '.prof'
+
+# <time_ns>-<pid>-<method>-<route>-<milliseconds>ms.prof
+PROFILE_NAME = re.compile(r'^(\d+)-(\d+)-([A-Z]+)-([\w.-]*)-(\d+)ms\.prof$')
+
+
+class RequestProfiler:
+    """Opt-in cProfile sampling of live requests
+
+    Profiles one in every `sample_rate` requests, plus any request whose
+    PROFILE_HEADER matches `token`. Each profile is dumped in pstats format
+    to `directory`, which is kept to the newest `keep` files. Disabled (no
+    rate and no token) it does nothing and the app skips its hooks.
+    """
+
+    def __init__(self, directory, sample_rate=0, token=None, keep=50):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token or None
+        self.keep = keep
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.token is not None
+
+    def authorized(self, value):
+        """Whether a header value carries the configured token"""
+        return self.token is not None and value is not None and hmac.compare_digest(value, self.token)
+
+    def start(self, header=None):
+        """A running profile if this request is sampled, otherwise None"""
+        sampled = self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0
+        if not sampled and not self.authorized(header):
+            return None
+        profile = cProfile.Profile()
+        profile.started = time.perf_counter()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, method, route):
+        """Stop a profile and add it to the ring buffer, returning its file name"""
+        profile.disable()
+        elapsed_ms = round((time.perf_counter() - profile.started) * 1000)
+        slug = re.sub(r'[^\w.-]+', '_', route).strip('_') or 'root'
+        name = f'{time.time_ns()}-{os.getpid()}-{method}-{slug}-{elapsed_ms}ms{PROFILE_SUFFIX}'
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self._trim()
+        return name
+
+    def _trim(self):
+        with self._lock:
+            names = self.names()
+            for name in names[self.keep:]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def names(self):
+        """Stored profile file names, newest first"""
+        try:
+            names = [name for name in os.listdir(self.directory) if PROFILE_NAME.match(name)]
+        except FileNotFoundError:
+            return []
+        return sorted(names, key=lambda name: int(name.split('-', 1)[0]), reverse=True)
+
+    def list(self):
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for name in self.names():
+            created, pid, method, route, elapsed_ms = PROFILE_NAME.match(name).groups()
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            profiles.append({
+                'name': name,
+                'created': int(created) / 1e9,
+                'pid': int(pid),
+                'method': method,
+                'route': route,
+                'duration_ms': int(elapsed_ms),
+                'size': size,
+            })
+        return profiles
+
+    def path(self, name):
+        """Path of a stored profile, or None for names that aren't one"""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
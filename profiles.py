@@ -0,0 +1,305 @@
+import threading
+from collections import OrderedDict
+
+from catalog import MATCH_BONUSES, MATCH_NUTRIENTS
+from colikes import create_colike_tables, record_like
+
+# Votes sent without a user_id, and every vote from before users existed
+DEFAULT_USER = 'default'
+
+# Profiles kept in memory at once, least recently used are dropped first
+MAX_CACHED_PROFILES = 1024
+
+# Liked-item aggregates kept per profile
+PROFILE_NUTRIENTS = [column for column, _, _ in MATCH_NUTRIENTS]
+PROFILE_CATEGORIES = [column for column, _ in MATCH_BONUSES]
+
+
+def migrate_preferences(conn):
+    """Give the vote history a user_id column and per-user indexes"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(preferences)')]
+    if 'user_id' not in columns:
+        # Votes from before users existed belong to the default user
+        conn.execute(f"ALTER TABLE preferences ADD COLUMN user_id TEXT NOT NULL DEFAULT '{DEFAULT_USER}'")
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_preferences_user
+    ON preferences (user_id, is_liked, food_id)
+    ''')
+
+
+def create_profile_tables(conn):
+    """Create the preference profile tables and backfill them from vote history
+
+    Profiles are keyed by user, so profile_id holds the voter's user_id.
+    """
+    migrate_preferences(conn)
+    sums = ',\n        '.join(f'sum_{column} REAL NOT NULL DEFAULT 0' for column in PROFILE_NUTRIENTS)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS preference_profiles (
+        profile_id TEXT PRIMARY KEY,
+        revision INTEGER NOT NULL DEFAULT 0,
+        catalog_version INTEGER NOT NULL DEFAULT 0,
+        liked_count INTEGER NOT NULL DEFAULT 0,
+        {sums}
+    )
+    ''')
+
+    # One row per rated item, flagging whether it was ever liked or disliked
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS profile_items (
+        profile_id TEXT NOT NULL,
+        food_id INTEGER NOT NULL,
+        liked INTEGER NOT NULL DEFAULT 0,
+        disliked INTEGER NOT NULL DEFAULT 0,
+        revision INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, food_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE INDEX IF NOT EXISTS idx_profile_items_revision
+    ON profile_items (profile_id, revision)
+    ''')
+
+    # Counts of liked items per category, restaurant, food and protein type
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS profile_histograms (
+        profile_id TEXT NOT NULL,
+        column_name TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (profile_id, column_name, value)
+    )
+    ''')
+
+    # Databases from before profiles existed only have the raw votes
+    has_items = conn.execute('SELECT 1 FROM profile_items LIMIT 1').fetchone()
+    has_votes = conn.execute('SELECT 1 FROM preferences LIMIT 1').fetchone()
+    if has_votes and not has_items:
+        conn.execute('''
+        INSERT INTO profile_items (profile_id, food_id, liked, disliked, revision)
+        SELECT user_id, food_id, MAX(is_liked = 1), MAX(is_liked = 0), 1
+        FROM preferences WHERE food_id IS NOT NULL GROUP BY user_id, food_id
+        ''')
+        users = conn.execute('SELECT DISTINCT profile_id FROM profile_items').fetchall()
+        for (user_id,) in users:
+            rebuild_aggregates(conn, user_id)
+
+    create_colike_tables(conn)
+
+
+def catalog_version(conn):
+    """Catalog version the loader keeps in PRAGMA user_version"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def rebuild_aggregates(conn, profile_id):
+    """Recompute a profile's sums and histograms from its liked items
+
+    Only needed after the catalog changes; votes update the aggregates
+    incrementally. Costs O(liked items), never a rescan of vote history.
+    """
+    sums = ', '.join(f'TOTAL(f.{column})' for column in PROFILE_NUTRIENTS)
+    row = conn.execute(f'''
+    SELECT COUNT(f.id), {sums}
+    FROM profile_items AS p JOIN foods AS f ON f.id = p.food_id
+    WHERE p.profile_id = ? AND p.liked = 1
+    ''', (profile_id,)).fetchone()
+
+    assignments = ', '.join(f'sum_{column} = ?' for column in PROFILE_NUTRIENTS)
+    conn.execute('INSERT OR IGNORE INTO preference_profiles (profile_id) VALUES (?)', (profile_id,))
+    conn.execute(f'''
+    UPDATE preference_profiles
+    SET revision = revision + 1, catalog_version = ?, liked_count = ?, {assignments}
+    WHERE profile_id = ?
+    ''', (catalog_version(conn), row[0], *row[1:], profile_id))
+
+    conn.execute('DELETE FROM profile_histograms WHERE profile_id = ?', (profile_id,))
+    for column in PROFILE_CATEGORIES:
+        conn.execute(f'''
+        INSERT INTO profile_histograms (profile_id, column_name, value, count)
+        SELECT ?, ?, f.{column}, COUNT(*)
+        FROM profile_items AS p JOIN foods AS f ON f.id = p.food_id
+        WHERE p.profile_id = ? AND p.liked = 1 AND f.{column} IS NOT NULL
+        GROUP BY f.{column}
+        ''', (profile_id, column, profile_id))
+
+
+class PreferenceProfile:
+    """In-memory copy of one profile's aggregates and rated items"""
+
+    def __init__(self, profile_id):
+        self.profile_id = profile_id
+        self.revision = None
+        self.liked_count = 0
+        self.sums = dict.fromkeys(PROFILE_NUTRIENTS, 0.0)
+        self.histograms = {column: {} for column in PROFILE_CATEGORIES}
+        self.liked = set()
+        self.disliked = set()
+
+    @property
+    def rated(self):
+        return self.liked | self.disliked
+
+    def averages(self):
+        """Mean of each nutrient over liked items found in the catalog"""
+        return {column: total / self.liked_count for column, total in self.sums.items()}
+
+    def liked_values(self):
+        """Values of each category column shared by at least one liked item"""
+        return {
+            column: {value for value, count in counts.items() if count > 0}
+            for column, counts in self.histograms.items()
+        }
+
+
+class ProfileStore:
+    """Keeps per-user preference profiles up to date as votes are written
+
+    record_votes() runs inside the write-behind transaction and updates the
+    stored aggregates in O(1) per vote. get() serves profiles from memory,
+    reloading only what changed when the stored revision moves on (another
+    worker wrote votes) and rebuilding aggregates when the catalog changes.
+    At most `max_cached` profiles are held, least recently used first out.
+    """
+
+    def __init__(self, max_cached=MAX_CACHED_PROFILES):
+        self.max_cached = max_cached
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def __len__(self):
+        return len(self._cache)
+
+    def ensure_tables(self, conn):
+        if not self._ready:
+            with conn:
+                create_profile_tables(conn)
+            self._ready = True
+
+    def record_votes(self, conn, votes):
+        """Write (user_id, food_id, is_liked) votes to the history and fold them into each profile"""
+        self.ensure_tables(conn)
+        conn.executemany('INSERT INTO preferences (user_id, food_id, is_liked) VALUES (?, ?, ?)', votes)
+
+        by_user = {}
+        for user_id, food_id, is_liked in votes:
+            by_user.setdefault(user_id, []).append((food_id, is_liked))
+
+        for profile_id, user_votes in by_user.items():
+            conn.execute(
+                'INSERT OR IGNORE INTO preference_profiles (profile_id, catalog_version) VALUES (?, ?)',
+                (profile_id, catalog_version(conn))
+            )
+            conn.execute(
+                'UPDATE preference_profiles SET revision = revision + 1 WHERE profile_id = ?',
+                (profile_id,)
+            )
+            revision = conn.execute(
+                'SELECT revision FROM preference_profiles WHERE profile_id = ?', (profile_id,)
+            ).fetchone()[0]
+
+            for food_id, is_liked in user_votes:
+                item = conn.execute(
+                    'SELECT liked FROM profile_items WHERE profile_id = ? AND food_id = ?',
+                    (profile_id, food_id)
+                ).fetchone()
+                flag = 'liked' if is_liked else 'disliked'
+                conn.execute(f'''
+                INSERT INTO profile_items (profile_id, food_id, {flag}, revision) VALUES (?, ?, 1, ?)
+                ON CONFLICT (profile_id, food_id) DO UPDATE SET {flag} = 1, revision = excluded.revision
+                ''', (profile_id, food_id, revision))
+
+                # Only the first like of an item changes the aggregates
+                if is_liked and (item is None or not item[0]):
+                    self._add_liked(conn, profile_id, food_id)
+                    record_like(conn, profile_id, food_id)
+
+    def _add_liked(self, conn, profile_id, food_id):
+        columns = ', '.join(PROFILE_NUTRIENTS + PROFILE_CATEGORIES)
+        food = conn.execute(f'SELECT {columns} FROM foods WHERE id = ?', (food_id,)).fetchone()
+        if food is None:
+            return
+
+        nutrients = [value or 0 for value in food[:len(PROFILE_NUTRIENTS)]]
+        assignments = ', '.join(f'sum_{column} = sum_{column} + ?' for column in PROFILE_NUTRIENTS)
+        conn.execute(f'''
+        UPDATE preference_profiles SET liked_count = liked_count + 1, {assignments}
+        WHERE profile_id = ?
+        ''', (*nutrients, profile_id))
+
+        for column, value in zip(PROFILE_CATEGORIES, food[len(PROFILE_NUTRIENTS):]):
+            if value is None:
+                continue
+            conn.execute('''
+            INSERT INTO profile_histograms (profile_id, column_name, value, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT (profile_id, column_name, value) DO UPDATE SET count = count + 1
+            ''', (profile_id, column, value))
+
+    def get(self, conn, profile_id=DEFAULT_USER):
+        """Current profile, refreshed from the database only if it changed"""
+        self.ensure_tables(conn)
+        row = conn.execute(
+            'SELECT catalog_version FROM preference_profiles WHERE profile_id = ?', (profile_id,)
+        ).fetchone()
+        if row is None:
+            return PreferenceProfile(profile_id)
+
+        # The catalog was reloaded since the sums were computed
+        if row['catalog_version'] != catalog_version(conn):
+            with conn:
+                rebuild_aggregates(conn, profile_id)
+
+        # Read the profile from one consistent snapshot of the database
+        conn.execute('BEGIN')
+        try:
+            return self._refresh(conn, profile_id)
+        finally:
+            conn.commit()
+
+    def _refresh(self, conn, profile_id):
+        row = conn.execute(
+            'SELECT * FROM preference_profiles WHERE profile_id = ?', (profile_id,)
+        ).fetchone()
+
+        with self._lock:
+            cached = self._cache.get(profile_id)
+            if cached is not None and cached.revision == row['revision']:
+                self._cache.move_to_end(profile_id)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+            profile = PreferenceProfile(profile_id)
+            since = -1
+            if cached is not None:
+                profile.liked = set(cached.liked)
+                profile.disliked = set(cached.disliked)
+                since = cached.revision
+
+            # Only items rated since the cached revision need loading
+            for item in conn.execute(
+                'SELECT food_id, liked, disliked FROM profile_items WHERE profile_id = ? AND revision > ?',
+                (profile_id, since)
+            ):
+                if item['liked']:
+                    profile.liked.add(item['food_id'])
+                if item['disliked']:
+                    profile.disliked.add(item['food_id'])
+
+            profile.revision = row['revision']
+            profile.liked_count = row['liked_count']
+            profile.sums = {column: row[f'sum_{column}'] for column in PROFILE_NUTRIENTS}
+            for histogram in conn.execute(
+                'SELECT column_name, value, count FROM profile_histograms WHERE profile_id = ?',
+                (profile_id,)
+            ):
+                profile.histograms[histogram['column_name']][histogram['value']] = histogram['count']
+
+            self._cache[profile_id] = profile
+            self._cache.move_to_end(profile_id)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+            return profile
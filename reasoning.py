@@ -0,0 +1,76 @@
+import operator
+from functools import lru_cache
+
+import numpy as np
+
+# Nutrients flagged when above the meal target, then those flagged when
+# below LOW_FACTOR of it. Bit i of a reasoning mask is NUTRIENT_BITS[i].
+HIGH_NUTRIENTS = ['calories', 'total_fat', 'saturated_fat', 'trans_fat', 'cholesterol', 'sodium', 'sugar']
+LOW_NUTRIENTS = ['dietary_fiber', 'protein']
+LOW_FACTOR = 0.7
+NUTRIENT_BITS = HIGH_NUTRIENTS + LOW_NUTRIENTS
+
+
+def _compare(values, op, target):
+    if values.dtype != np.float32:
+        return op(values, target)
+    # Compare float32 columns in their own precision, then settle values that
+    # round to the same float32 as the target using the decimal they stand for
+    narrowed = np.float32(target)
+    flagged = op(values, narrowed)
+    ties = np.flatnonzero(values == narrowed)
+    if len(ties):
+        flagged[ties] = op(values[ties].astype(str).astype(np.float64), target)
+    return flagged
+
+
+def nutrient_masks(columns, meal_values, positions=None):
+    """High/low bitmask of each row against per-meal nutrient targets
+
+    Compares whole columns at once; missing values never set a bit.
+    """
+    size = len(columns['id']) if positions is None else len(positions)
+    masks = np.zeros(size, dtype=np.uint16)
+    for bit, nutrient in enumerate(NUTRIENT_BITS):
+        if nutrient not in columns:
+            continue
+        values = np.asarray(columns[nutrient])
+        if positions is not None:
+            values = values[positions]
+        if nutrient in LOW_NUTRIENTS:
+            flagged = _compare(values, operator.lt, meal_values[nutrient] * LOW_FACTOR)
+        else:
+            flagged = _compare(values, operator.gt, meal_values[nutrient])
+        masks |= flagged.astype(np.uint16) << bit
+    return masks
+
+
+@lru_cache(maxsize=None)
+def mask_text(mask):
+    """Reasoning text for one mask, at most 2**9 distinct ones ever exist"""
+    high = [nutrient.replace('_', ' ') for bit, nutrient in enumerate(NUTRIENT_BITS)
+            if mask >> bit & 1 and nutrient in HIGH_NUTRIENTS]
+    low = [nutrient.replace('_', ' ') for bit, nutrient in enumerate(NUTRIENT_BITS)
+           if mask >> bit & 1 and nutrient in LOW_NUTRIENTS]
+
+    if not high and not low:
+        return "Balanced"
+
+    parts = []
+    if high:
+        parts.append(f"High: {', '.join(high)}")
+    if low:
+        parts.append(f"Low: {', '.join(low)}")
+
+    return " | ".join(parts)
+
+
+def render(masks):
+    """Reasoning text for each mask, rendering every distinct mask once"""
+    masks = np.asarray(masks)
+    if len(masks) == 0:
+        return []
+    distinct, inverse = np.unique(masks, return_inverse=True)
+    texts = np.array([mask_text(int(mask)) for mask in distinct], dtype=object)
+    return texts[inverse].tolist()
+
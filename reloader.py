@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import traceback
+
+from snapshot import CURRENT_FILE
+
+
+class CatalogReloader:
+    """Background watcher that rebuilds the catalog when its sources change
+
+    With a snapshot directory present only its CURRENT pointer is watched.
+    Otherwise the pickle's mtime and the database are watched: PRAGMA
+    data_version tells us cheaply that another connection committed, and
+    only then is the loader-maintained PRAGMA user_version read to see
+    whether foods (rather than preferences) changed.
+
+    The new catalog is built on the watcher thread and handed to `swap`,
+    so requests never wait on a rebuild.
+    """
+
+    def __init__(self, snapshot_path, model_path, db_path, load, swap, interval=2.0):
+        self.snapshot_path = snapshot_path
+        self.model_path = model_path
+        self.db_path = db_path
+        self.load = load
+        self.swap = swap
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._conn = None
+        self._data_version = None
+        self._user_version = None
+        self._last = self.fingerprint()
+
+    def _read_pointer(self):
+        try:
+            with open(os.path.join(self.snapshot_path, CURRENT_FILE)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _model_mtime(self):
+        try:
+            return os.stat(self.model_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _db_version(self):
+        if not os.path.exists(self.db_path):
+            return None
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._user_version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        return self._user_version
+
+    def fingerprint(self):
+        """Tuple that changes whenever the catalog source does"""
+        pointer = self._read_pointer()
+        if pointer is not None:
+            return ('snapshot', pointer)
+        return ('files', self._model_mtime(), self._db_version())
+
+    def check(self):
+        """Reload and swap the catalog if its source changed, returns True if it did"""
+        current = self.fingerprint()
+        if current == self._last:
+            return False
+
+        # Only the database moved, the pickle on disk is older than it
+        previous = self._last
+        from_db = (
+            current[0] == 'files' and previous[0] == 'files' and
+            current[1] == previous[1] and current[2] != previous[2]
+        )
+        self.swap(self.load(from_db=from_db))
+        self._last = current
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # Keep serving the current catalog and try again next poll
+                traceback.print_exc()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='catalog-reloader', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
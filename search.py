@@ -0,0 +1,167 @@
+import bisect
+import re
+from collections import Counter
+
+import numpy as np
+
+from catalog import column_codes, top_k
+
+# A name match counts this many times more than a description match
+NAME_WEIGHT = 3.0
+
+# BM25 term-frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Most frequent completions of a typed prefix searched for and suggested
+MAX_EXPANSIONS = 50
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+
+def tokenize(text):
+    """Lowercase word tokens of a string, nothing for missing values"""
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _tokenized_rows(column):
+    # Tokenize each distinct value once and share the result across rows
+    codes, uniques = column_codes(column)
+    tokens = [tokenize(value) for value in uniques]
+    return [tokens[code] if code >= 0 else [] for code in codes.tolist()]
+
+
+class SearchIndex:
+    """In-memory inverted index over item names and descriptions
+
+    Postings are stored CSR-style: the rows of term t are
+    positions[offsets[t]:offsets[t + 1]] in ascending order, with their
+    BM25 term weights alongside. The vocabulary is kept sorted so a prefix
+    maps to one contiguous range of term ids found by binary search,
+    which is what makes autocomplete cheap.
+    """
+
+    def __init__(self, columns):
+        names = _tokenized_rows(columns['item_name'])
+        if 'item_description' in columns:
+            descriptions = _tokenized_rows(columns['item_description'])
+        else:
+            descriptions = [[]] * len(names)
+
+        rows = []
+        for name_tokens, description_tokens in zip(names, descriptions):
+            counts = Counter()
+            for token in name_tokens:
+                counts[token] += NAME_WEIGHT
+            for token in description_tokens:
+                counts[token] += 1.0
+            rows.append(counts)
+
+        self.size = len(rows)
+        self.terms = sorted({token for counts in rows for token in counts})
+        term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+
+        lengths = np.array([sum(counts.values()) for counts in rows], dtype=np.float64)
+        average_length = lengths.mean() if self.size and lengths.mean() > 0 else 1.0
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+
+        total = sum(len(counts) for counts in rows)
+        entry_terms = np.empty(total, dtype=np.int64)
+        entry_positions = np.empty(total, dtype=np.int64)
+        entry_counts = np.empty(total, dtype=np.float64)
+        i = 0
+        for position, counts in enumerate(rows):
+            for token, count in counts.items():
+                entry_terms[i] = term_ids[token]
+                entry_positions[i] = position
+                entry_counts[i] = count
+                i += 1
+
+        # Rows were added in order, so a stable sort keeps each term's rows ascending
+        order = np.argsort(entry_terms, kind='stable')
+        self.positions = entry_positions[order]
+        counts = entry_counts[order]
+        self.weights = counts * (BM25_K1 + 1) / (counts + norms[self.positions])
+
+        self.document_frequency = np.bincount(entry_terms, minlength=len(self.terms))
+        self.offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.document_frequency)
+        df = self.document_frequency
+        self.idf = np.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def _term_id(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else None
+
+    def expansions(self, prefix, limit=MAX_EXPANSIONS):
+        """Ids of the most frequent terms starting with prefix, most frequent first
+
+        Terms equally frequent stay in alphabetical order.
+        """
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + '\U0010ffff')
+        term_ids = np.arange(start, end)
+        frequent = np.argsort(-self.document_frequency[term_ids], kind='stable')[:limit]
+        return term_ids[frequent]
+
+    def _postings(self, term_ids):
+        # Rows holding any of the terms, with their summed idf-weighted scores
+        if len(term_ids) == 1:
+            term_id = term_ids[0]
+            span = slice(self.offsets[term_id], self.offsets[term_id + 1])
+            return self.positions[span], self.weights[span] * self.idf[term_id]
+
+        positions = []
+        scores = []
+        for term_id in term_ids:
+            span = slice(self.offsets[term_id], self.offsets[term_id + 1])
+            positions.append(self.positions[span])
+            scores.append(self.weights[span] * self.idf[term_id])
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        positions, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        return positions, np.bincount(inverse, weights=np.concatenate(scores))
+
+    def search(self, query, limit=10, prefix=True):
+        """Rank rows matching every word of the query
+
+        With `prefix` the last word may be incomplete and matches any term
+        it starts, as it does while the user is still typing. Returns
+        (positions, scores, completions) where completions are the most
+        frequent terms the last word could complete to.
+        """
+        words = tokenize(query)
+        empty = np.empty(0, dtype=np.int64), np.empty(0), []
+        if not words:
+            return empty
+
+        # Each word is a list of term ids, exact words have just one
+        completions = []
+        matches = []
+        for i, word in enumerate(words):
+            if prefix and i == len(words) - 1:
+                term_ids = self.expansions(word)
+                completions = [self.terms[term_id] for term_id in term_ids[:5]]
+            else:
+                term_id = self._term_id(word)
+                term_ids = [] if term_id is None else [term_id]
+            if len(term_ids) == 0:
+                return empty[0], empty[1], completions
+            matches.append(term_ids)
+
+        # Intersect the rarest words first so the candidate set shrinks fast
+        matches.sort(key=lambda term_ids: int(self.document_frequency[term_ids].sum()))
+        positions, scores = self._postings(matches[0])
+        for term_ids in matches[1:]:
+            other_positions, other_scores = self._postings(term_ids)
+            positions, here, there = np.intersect1d(
+                positions, other_positions, assume_unique=True, return_indices=True
+            )
+            scores = scores[here] + other_scores[there]
+            if len(positions) == 0:
+                break
+
+        top = top_k(scores, limit)
+        return positions[top], scores[top], completions
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+from flask import Response, jsonify
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NO_ANALYSIS = 'No nutritional analysis available.'
+NO_DESCRIPTION = 'No description available.'
+
+# Response fields: (key, column, kind, default). Kinds are 'int' and 'float'
+# for cast numbers, 'raw' for values passed through as stored, and 'text'
+# for strings where missing values become the default. The default is also
+# used for every row when the column is absent from the catalog.
+RECOMMEND_FIELDS = [
+    ('id', 'id', 'int', None),
+    ('restaurant', 'restaurant', 'raw', None),
+    ('item_name', 'item_name', 'raw', None),
+    ('calories', 'calories', 'int', None),
+    ('health_score', 'health_score', 'float', None),
+    ('protein', 'protein', 'float', None),
+    ('carbs', 'carbohydrates', 'float', None),
+    ('fat', 'total_fat', 'float', None),
+    ('fiber', 'dietary_fiber', 'float', None),
+    ('sugar', 'sugar', 'float', None),
+    ('sodium', 'sodium', 'float', None),
+    ('protein_type', 'protein_type', 'raw', 'Unknown'),
+    ('food_type', 'food_type', 'raw', 'Unknown'),
+    ('reasoning', 'reasoning', 'text', NO_ANALYSIS),
+]
+
+HEALTHY_OPTION_FIELDS = [
+    ('id', 'id', 'int', None),
+    ('restaurant', 'restaurant', 'raw', None),
+    ('item_name', 'item_name', 'raw', None),
+    ('calories', 'calories', 'int', None),
+    ('health_score', 'health_score', 'float', None),
+    ('protein', 'protein', 'float', None),
+    ('carbs', 'carbohydrates', 'float', None),
+    ('fat', 'total_fat', 'float', None),
+    ('fiber', 'dietary_fiber', 'float', None),
+    ('protein_type', 'protein_type', 'raw', 'Unknown'),
+    ('protein_confidence', 'protein_confidence', 'float', 0.0),
+    ('food_type', 'food_type', 'raw', 'Unknown'),
+    ('food_type_confidence', 'food_type_confidence', 'float', 0.0),
+    ('reasoning', 'reasoning', 'text', NO_ANALYSIS),
+]
+
+MATCH_FIELDS = HEALTHY_OPTION_FIELDS + [
+    ('sugar', 'sugar', 'float', None),
+    ('sodium', 'sodium', 'float', None),
+]
+
+SUGGESTION_FIELDS = [
+    ('id', 'id', 'int', None),
+    ('restaurant', 'restaurant', 'raw', None),
+    ('item_name', 'item_name', 'raw', None),
+    ('calories', 'calories', 'raw', None),
+    ('health_score', 'health_score', 'float', None),
+    ('protein', 'protein', 'raw', None),
+    ('carbs', 'carbohydrates', 'raw', None),
+    ('fat', 'total_fat', 'raw', None),
+    ('fiber', 'dietary_fiber', 'raw', None),
+    ('sugar', 'sugar', 'raw', None),
+    ('sodium', 'sodium', 'raw', None),
+    ('description', 'item_description', 'text', NO_DESCRIPTION),
+]
+
+SEARCH_FIELDS = [
+    ('id', 'id', 'int', None),
+    ('restaurant', 'restaurant', 'raw', None),
+    ('item_name', 'item_name', 'raw', None),
+    ('description', 'item_description', 'text', NO_DESCRIPTION),
+    ('calories', 'calories', 'int', None),
+    ('health_score', 'health_score', 'float', None),
+    ('protein_type', 'protein_type', 'raw', 'Unknown'),
+    ('food_type', 'food_type', 'raw', 'Unknown'),
+]
+
+TEST_CARD_FIELDS = [
+    ('id', 'id', 'raw', None),
+    ('name', 'item_name', 'raw', None),
+    ('restaurant', 'restaurant', 'raw', None),
+    ('calories', 'calories', 'int', None),
+    ('protein', 'protein', 'float', None),
+    ('carbs', 'carbohydrates', 'float', None),
+    ('fat', 'total_fat', 'float', None),
+    ('health_score', 'health_score', 'float', None),
+    ('protein_type', 'protein_type', 'raw', None),
+    ('food_type', 'food_type', 'raw', None),
+]
+
+
+def _column_values(values, kind, default):
+    if kind == 'int':
+        return values.astype(np.int64).tolist()
+    if kind == 'float':
+        if values.dtype == np.float32:
+            # Shortest decimal that round-trips, so a stored 4.9 is sent as 4.9
+            return values.astype(str).astype(np.float64).tolist()
+        return values.astype(np.float64).tolist()
+    if kind == 'text':
+        present = pd.notna(values)
+        return [value if keep else default for value, keep in zip(values.tolist(), present)]
+    return values.tolist()
+
+
+def serialize_rows(columns, positions, fields):
+    """Build response dicts for the rows at the given positions
+
+    Works column by column on the catalog arrays, so no per-row pandas
+    objects are created.
+    """
+    positions = np.asarray(positions, dtype=np.intp)
+    keys = []
+    values = []
+    for key, column, kind, default in fields:
+        keys.append(key)
+        if column in columns:
+            values.append(_column_values(columns[column][positions], kind, default))
+        else:
+            values.append([default] * len(positions))
+    return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+def frame_columns(df):
+    """Column arrays of a DataFrame keyed by column name"""
+    return {column: df[column].to_numpy() for column in df.columns}
+
+
+def json_response(payload, status=200):
+    """Serialize a response with orjson when it is installed, falling back to jsonify"""
+    if orjson is None:
+        return jsonify(payload), status
+    body = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return Response(body, status=status, mimetype='application/json')
@@ -0,0 +1,286 @@
+"""Pre-fork production server for the Flask app
+
+Usage:
+    python serve.py --workers 4 --port 5000
+
+The master process imports the app once, which loads the catalog, warms
+it up and freezes the garbage collector's view of it, then binds the
+listening socket and forks the workers. Each worker shares the catalog
+copy-on-write, warms its own database connection and only then starts
+accepting, so the other workers keep taking connections in the meantime.
+
+Workers are recycled after --max-requests requests (plus up to
+--max-requests-jitter, so they don't all restart together): they stop
+accepting, finish the requests in flight and flush queued votes before
+exiting, and the master forks a replacement.
+
+Only the master watches the catalog's sources, every
+CATALOG_RELOAD_INTERVAL seconds. When they change it reloads the catalog
+once and gracefully replaces every worker, so they keep sharing a single
+copy. SIGHUP forces a reload. SIGTERM or SIGINT drains the workers and
+stops.
+"""
+import argparse
+import gc
+import itertools
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+
+from reasoning import nutrient_masks, render
+from serializers import RECOMMEND_FIELDS, serialize_rows
+from snapshot import EncodedColumn
+
+# A worker that dies this soon after starting is restarted after a pause
+CRASH_WINDOW = 5.0
+CRASH_PAUSE = 1.0
+
+
+def log(message):
+    print(f'[serve {os.getpid()}] {message}', file=sys.stderr, flush=True)
+
+
+def touch(column):
+    # Fault in every page of a memory-mapped column
+    arrays = (column.codes, column.offsets, column.data) if isinstance(column, EncodedColumn) else (column,)
+    for array in arrays:
+        if len(array):
+            np.asarray(array).max()
+
+
+def warm_up(app_module):
+    """Read the whole catalog and run one query of each kind against it"""
+    package = app_module.model_package
+    if package is None:
+        return
+    index = package['index']
+    for column in index.columns.values():
+        touch(column)
+
+    positions = index.healthiest(10)
+    index.resolve(0, 2000, 1, 10, count=5)
+    serialize_rows(index.columns, positions, RECOMMEND_FIELDS)
+    render(nutrient_masks(index.columns, app_module.meal_values, positions))
+    package['text'].similarity(positions)
+    package['search'].search('chicken', 10, prefix=True)
+    if len(positions):
+        package['similar'].nearest(int(positions[0]), 10)
+
+
+class RequestLimit:
+    """WSGI middleware calling `on_limit` once `limit` requests have started"""
+
+    def __init__(self, wsgi_app, limit, on_limit):
+        self.wsgi_app = wsgi_app
+        self.limit = limit
+        self.on_limit = on_limit
+        self._served = itertools.count(1)
+
+    def __call__(self, environ, start_response):
+        if next(self._served) == self.limit:
+            self.on_limit()
+        return self.wsgi_app(environ, start_response)
+
+
+def run_worker(app_module, sock, args):
+    """Serve on the inherited socket until recycled or told to stop"""
+    from werkzeug.serving import make_server
+
+    # Until serving starts there is nothing to drain, so SIGTERM just exits
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    # A forked worker inherits the master's random state, so reseed it or
+    # every worker hands out the same "random" picks in the same order
+    random.seed()
+    np.random.seed()
+
+    # Open this worker's own database connection before taking traffic
+    conn = app_module.db_pool.acquire()
+    try:
+        app_module.profile_store.ensure_tables(conn)
+    finally:
+        app_module.db_pool.release(conn)
+    warm_up(app_module)
+
+    server = None
+
+    def stop(*_):
+        # shutdown() waits for serve_forever() to return, so not on its thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    wsgi_app = app_module.app
+    if args.max_requests:
+        wsgi_app = RequestLimit(wsgi_app, args.max_requests + random.randint(0, args.max_requests_jitter), stop)
+    server = make_server(args.host, args.port, wsgi_app, threaded=True, fd=sock.fileno())
+    # Let server_close() wait for the requests still in flight
+    server.daemon_threads = False
+    server.block_on_close = True
+    signal.signal(signal.SIGTERM, stop)
+
+    server.serve_forever()
+    server.server_close()
+    app_module.vote_queue.close()
+    app_module.db_pool.close()
+
+
+class Master:
+    """Forks the workers and replaces them as they exit"""
+
+    def __init__(self, app_module, sock, args):
+        self.app_module = app_module
+        self.sock = sock
+        self.args = args
+        self.workers = {}
+        self.retiring = set()
+        self.stopping = False
+        self.reload = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.app_module, self.sock, self.args)
+            except BaseException:
+                logging.exception('Worker failed')
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        return pid
+
+    def freeze(self):
+        # Keep the collector from writing to (and so copying) the catalog's
+        # pages, after letting it free whatever a previous catalog left
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+
+    def reload_catalog(self):
+        """Reload the catalog if its sources changed, returns True if it did"""
+        try:
+            return self.app_module.catalog_reloader.check()
+        except Exception:
+            logging.exception('Catalog reload failed, keeping the current one')
+            return False
+
+    def replace_all(self):
+        """Swap every worker for a fresh one forked from the current catalog"""
+        warm_up(self.app_module)
+        self.freeze()
+
+        old = list(self.workers)
+        for _ in old:
+            self.spawn()
+        for pid in old:
+            self.retiring.add(pid)
+            os.kill(pid, signal.SIGTERM)
+        log(f'Replacing {len(old)} workers')
+
+    def reap(self):
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+            if self.stopping:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code != 0 and time.monotonic() - started < CRASH_WINDOW:
+                log(f'Worker {pid} exited with {code} right after starting')
+                time.sleep(CRASH_PAUSE)
+            self.spawn()
+
+    def run(self):
+        def request_stop(*_):
+            self.stopping = True
+
+        def request_reload(*_):
+            self.reload = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        self.freeze()
+        for _ in range(self.args.workers):
+            self.spawn()
+        log(f'Serving on {self.args.host}:{self.args.port} with {self.args.workers} workers')
+
+        interval = self.app_module.CATALOG_RELOAD_INTERVAL
+        next_check = time.monotonic() + interval
+        while not self.stopping:
+            if self.reload:
+                self.reload = False
+                self.reload_catalog()
+                self.replace_all()
+            elif interval > 0 and time.monotonic() >= next_check:
+                next_check = time.monotonic() + interval
+                if self.reload_catalog():
+                    self.replace_all()
+            self.reap()
+            time.sleep(0.1)
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Drain every worker, killing any still running after the grace period"""
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.workers.clear()
+        self.sock.close()
+        log('Stopped')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-requests', type=int, default=10000, help='recycle a worker after this many requests, 0 never')
+    parser.add_argument('--max-requests-jitter', type=int, default=1000, help='random extra requests per worker')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0, help='seconds workers get to drain on shutdown')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    # Importing the app loads the catalog, once, before any fork
+    import app as app_module
+    if app_module.model_package is None:
+        log('No catalog found, run db_setup.py first')
+
+    # The master polls for catalog changes itself, a thread wouldn't survive the fork
+    app_module.catalog_reloader.stop()
+    warm_up(app_module)
+
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    Master(app_module, sock, args).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from catalog import MATCH_NUTRIENTS, top_k
+
+# Filtered searches over at most this many rows just scan them directly
+BRUTE_FORCE_LIMIT = 4096
+
+
+class SimilarityIndex:
+    """KD-tree over the nutrition vectors get_matches() compares
+
+    Each row becomes (calories, protein, total_fat, carbohydrates,
+    health_score) divided by the matching distance scales, so one unit is
+    the same "difference" on every axis. Missing values count as 0.
+    """
+
+    def __init__(self, index, brute_force_limit=BRUTE_FORCE_LIMIT):
+        self.brute_force_limit = brute_force_limit
+        self.vectors = np.column_stack([
+            np.nan_to_num(np.asarray(index.columns[column], dtype=np.float64)) / scale
+            for column, scale, _ in MATCH_NUTRIENTS
+        ])
+        self.size = len(self.vectors)
+        self.tree = KDTree(self.vectors)
+
+    def nearest(self, position, k, mask=None):
+        """Positions and distances of the k rows closest to `position`
+
+        The row itself is never returned. With a boolean `mask` only rows
+        where it is True are considered: small candidate sets are scanned
+        directly, larger ones are searched in the tree, asking for enough
+        neighbours that k of them are expected to pass the filter.
+        """
+        point = self.vectors[position]
+        allowed = self.size - 1
+
+        if mask is not None:
+            mask = mask.copy()
+            mask[position] = False
+            candidates = np.flatnonzero(mask)
+            allowed = len(candidates)
+            if allowed <= self.brute_force_limit:
+                distances = np.sqrt(((self.vectors[candidates] - point) ** 2).sum(axis=1))
+                top = top_k(-distances, k)
+                return candidates[top], distances[top]
+
+        k = min(k, allowed)
+        if k <= 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        # Over-fetch in proportion to how selective the filter is
+        want = int((k + 1) * self.size / allowed * 1.25) + 1
+        while True:
+            n = min(want, self.size)
+            distances, positions = self.tree.query(point.reshape(1, -1), k=n)
+            distances, positions = distances[0], positions[0]
+            keep = positions != position
+            if mask is not None:
+                keep &= mask[positions]
+            if keep.sum() >= k or n == self.size:
+                return positions[keep][:k], distances[keep][:k]
+            want = n * 4
@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# File inside the snapshot directory naming the live version subdirectory
+CURRENT_FILE = 'CURRENT'
+
+# Older versions kept around for workers that still have them mapped
+KEEP_VERSIONS = 2
+
+
+class EncodedColumn:
+    """Dictionary-encoded string column backed by read-only arrays
+
+    `codes` index a table of distinct values stored Arrow-style as one
+    UTF-8 byte buffer plus offsets, and -1 marks a missing value. Values
+    are only decoded for the positions that are asked for, so the arrays
+    can stay memory-mapped and shared between processes.
+    """
+
+    def __init__(self, codes, offsets, data):
+        self.codes = codes
+        self.offsets = offsets
+        self.data = data
+        self._uniques = None
+
+    @classmethod
+    def encode(cls, values):
+        """Build an in-memory encoded column from any sequence of strings"""
+        codes, uniques = pd.factorize(values, sort=False)
+        encoded = [str(value).encode('utf-8') for value in uniques]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(value) for value in encoded])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        code_dtype = np.int16 if len(uniques) < 2 ** 15 else np.int32
+        return cls(codes.astype(code_dtype), offsets, data)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def _decode(self, code):
+        if code < 0:
+            return None
+        return self.data[self.offsets[code]:self.offsets[code + 1]].tobytes().decode('utf-8')
+
+    @property
+    def uniques(self):
+        """Every distinct value, decoded once and cached"""
+        if self._uniques is None:
+            uniques = np.empty(len(self.offsets) - 1, dtype=object)
+            for code in range(len(uniques)):
+                uniques[code] = self._decode(code)
+            self._uniques = uniques
+        return self._uniques
+
+    def __getitem__(self, positions):
+        codes = self.codes[positions]
+        values = np.empty(len(codes), dtype=object)
+        for i, code in enumerate(codes.tolist()):
+            values[i] = self._decode(code)
+        return values
+
+    def to_numpy(self):
+        return self[np.arange(len(self))]
+
+
+def narrow_numeric(values):
+    """Float columns as float32 and integer columns in the smallest int type that holds them"""
+    array = np.asarray(values)
+    if array.dtype.kind == 'f':
+        return array.astype(np.float32)
+    if array.dtype.kind in 'iu' and len(array):
+        low, high = array.min(), array.max()
+        for dtype in (np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return array.astype(dtype)
+    return array
+
+
+def compact_columns(df):
+    """Catalog columns of a frame in the compact in-memory layout
+
+    Numbers are narrowed with narrow_numeric() and strings, descriptions
+    included, become dictionary-encoded byte tables, so no per-row Python
+    objects are kept. This is the same layout the snapshot stores.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values):
+            columns[column] = narrow_numeric(values.to_numpy())
+        else:
+            columns[column] = EncodedColumn.encode(values)
+    return columns
+
+
+def current_version_path(path):
+    """Directory of the live snapshot version, or None if there isn't one"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    version_path = os.path.join(path, name)
+    return version_path if os.path.isdir(version_path) else None
+
+
+def write_snapshot(df, path, extra=None):
+    """Write the catalog frame as a columnar snapshot and make it current
+
+    Numeric columns are saved as one .npy file each and string columns as
+    dictionary codes plus an offsets/bytes table. Each write goes to a new
+    version directory and the CURRENT pointer is swapped atomically, so
+    readers never see a half-written snapshot. `extra(version_path,
+    previous_path)` can add derived files before the swap.
+    """
+    os.makedirs(path, exist_ok=True)
+    previous = current_version_path(path)
+    version = 1
+    if previous is not None:
+        with open(os.path.join(previous, 'manifest.json')) as f:
+            version = json.load(f)['version'] + 1
+
+    name = f'v{version}'
+    version_path = os.path.join(path, name)
+    shutil.rmtree(version_path, ignore_errors=True)
+    os.makedirs(version_path)
+
+    manifest = {'version': version, 'rows': len(df), 'columns': []}
+    for column, values in compact_columns(df).items():
+        if isinstance(values, np.ndarray):
+            array = np.ascontiguousarray(values)
+            np.save(os.path.join(version_path, f'{column}.npy'), array)
+            manifest['columns'].append({'name': column, 'kind': 'numeric', 'dtype': str(array.dtype)})
+        else:
+            np.save(os.path.join(version_path, f'{column}.codes.npy'), values.codes)
+            np.save(os.path.join(version_path, f'{column}.offsets.npy'), values.offsets)
+            np.save(os.path.join(version_path, f'{column}.data.npy'), values.data)
+            manifest['columns'].append({'name': column, 'kind': 'string'})
+
+    if extra is not None:
+        extra(version_path, previous)
+
+    with open(os.path.join(version_path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    # Point CURRENT at the new version in one rename
+    pointer = os.path.join(path, CURRENT_FILE)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    # Drop versions old enough that no running worker should still use them
+    versions = sorted(
+        (int(entry[1:]), entry) for entry in os.listdir(path)
+        if entry.startswith('v') and entry[1:].isdigit()
+    )
+    for _, entry in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+    return version
+
+
+def load_snapshot(path):
+    """Memory-map the current snapshot read-only
+
+    Returns (columns, manifest) where columns maps each column name to a
+    NumPy array or an EncodedColumn, and the manifest also records the
+    version directory under 'path'.
+    """
+    version_path = current_version_path(path)
+    if version_path is None:
+        raise FileNotFoundError(f"No catalog snapshot in '{path}'")
+
+    with open(os.path.join(version_path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    manifest['path'] = version_path
+
+    def load(filename):
+        return np.load(os.path.join(version_path, filename), mmap_mode='r')
+
+    columns = {}
+    for column in manifest['columns']:
+        name = column['name']
+        if column['kind'] == 'numeric':
+            columns[name] = load(f'{name}.npy')
+        else:
+            columns[name] = EncodedColumn(
+                load(f'{name}.codes.npy'),
+                load(f'{name}.offsets.npy'),
+                load(f'{name}.data.npy')
+            )
+    return columns, manifest
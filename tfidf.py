@@ -0,0 +1,177 @@
+import json
+import os
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from catalog import column_codes
+from search import NAME_WEIGHT, tokenize
+
+# Files written next to the catalog snapshot columns
+TFIDF_FILES = ('indptr', 'indices', 'counts', 'weights', 'hashes')
+TERMS_FILE = 'tfidf.terms.json'
+
+# Compact the vocabulary once more than this share of it is unused
+MAX_UNUSED_TERMS = 0.5
+
+
+def text_hashes(columns):
+    """64-bit hash of each row's name and description, to spot unchanged rows"""
+    def hashes(name):
+        if name not in columns:
+            return np.zeros(len(columns['id']), dtype=np.uint64)
+        codes, uniques = column_codes(columns[name])
+        unique_hashes = pd.util.hash_array(np.asarray(uniques, dtype=object))
+        return np.where(codes >= 0, unique_hashes[np.maximum(codes, 0)], np.uint64(0))
+
+    return hashes('item_name') * np.uint64(1000003) ^ hashes('item_description')
+
+
+def _row_terms(name, description):
+    counts = Counter()
+    for token in tokenize(name):
+        counts[token] += NAME_WEIGHT
+    for token in tokenize(description):
+        counts[token] += 1.0
+    return counts
+
+
+class TfidfIndex:
+    """Sparse TF-IDF matrix over item names and descriptions
+
+    Rows are catalog positions, columns are vocabulary terms. The raw term
+    counts are kept alongside the L2-normalized TF-IDF weights so that a
+    rebuild can reuse the counts of every row whose text didn't change and
+    only tokenize new or edited items; the IDF and weights are then
+    recomputed for the whole matrix in a few vectorized passes.
+    """
+
+    def __init__(self, terms, indptr, indices, counts, hashes, weights=None):
+        self.terms = terms
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.hashes = hashes
+        self.size = len(hashes)
+        if weights is None:
+            weights = self._weights()
+        self.weights = weights
+        self.matrix = csr_matrix((weights, indices, indptr), shape=(self.size, len(terms)), copy=False)
+
+    def _weights(self):
+        lengths = np.diff(self.indptr)
+        document_frequency = np.bincount(self.indices, minlength=len(self.terms))
+        idf = np.log((1 + self.size) / (1 + document_frequency)) + 1
+        weights = ((1 + np.log(self.counts)) * idf[self.indices]).astype(np.float32)
+
+        rows = np.repeat(np.arange(self.size), lengths)
+        norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=self.size))
+        norms[norms == 0] = 1
+        return weights / norms[rows].astype(np.float32)
+
+    @classmethod
+    def build(cls, columns, previous=None):
+        """Build the index for a catalog, reusing rows of `previous` whose text is unchanged"""
+        hashes = text_hashes(columns)
+        size = len(hashes)
+
+        # Row of the previous index holding the same text, or -1
+        source = np.full(size, -1, dtype=np.int64)
+        terms = []
+        if previous is not None and previous.size:
+            order = np.argsort(previous.hashes, kind='stable')
+            sorted_hashes = previous.hashes[order]
+            found = np.minimum(np.searchsorted(sorted_hashes, hashes), len(order) - 1)
+            hit = sorted_hashes[found] == hashes
+            source[hit] = order[found[hit]]
+            terms = list(previous.terms)
+
+        # Tokenize only the rows that couldn't be reused, appending new terms
+        term_ids = {term: term_id for term_id, term in enumerate(terms)}
+        fresh = np.flatnonzero(source < 0)
+        names = columns['item_name'][fresh] if len(fresh) else []
+        if 'item_description' in columns and len(fresh):
+            descriptions = columns['item_description'][fresh]
+        else:
+            descriptions = [None] * len(fresh)
+        fresh_rows = []
+        for name, description in zip(names, descriptions):
+            row = {}
+            for term, count in _row_terms(name, description).items():
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(terms)
+                    terms.append(term)
+                row[term_id] = count
+            fresh_rows.append(sorted(row.items()))
+
+        lengths = np.zeros(size, dtype=np.int64)
+        reused = np.flatnonzero(source >= 0)
+        if len(reused):
+            lengths[reused] = np.diff(previous.indptr)[source[reused]]
+        lengths[fresh] = [len(row) for row in fresh_rows]
+
+        # One index dtype for both arrays so scipy can use them without copying
+        nnz = int(lengths.sum())
+        index_dtype = np.int32 if max(nnz, len(terms)) < 2 ** 31 else np.int64
+        indptr = np.zeros(size + 1, dtype=index_dtype)
+        indptr[1:] = np.cumsum(lengths)
+        indices = np.empty(nnz, dtype=index_dtype)
+        counts = np.empty(nnz, dtype=np.float32)
+
+        # Copy reused rows' entries across in one gather
+        if len(reused):
+            reused_lengths = lengths[reused]
+            starts = np.cumsum(reused_lengths) - reused_lengths
+            within = np.arange(reused_lengths.sum()) - np.repeat(starts, reused_lengths)
+            destination = np.repeat(indptr[reused], reused_lengths) + within
+            origin = np.repeat(previous.indptr[source[reused]], reused_lengths) + within
+            indices[destination] = previous.indices[origin]
+            counts[destination] = previous.counts[origin]
+
+        for position, row in zip(fresh.tolist(), fresh_rows):
+            start = indptr[position]
+            for offset, (term_id, count) in enumerate(row):
+                indices[start + offset] = term_id
+                counts[start + offset] = count
+
+        # Drop terms no row uses any more once they pile up
+        used = np.bincount(indices, minlength=len(terms)) > 0
+        if len(terms) and (~used).sum() > MAX_UNUSED_TERMS * len(terms):
+            remap = np.cumsum(used) - 1
+            indices = remap[indices].astype(index_dtype)
+            terms = [term for term, keep in zip(terms, used.tolist()) if keep]
+
+        return cls(terms, indptr, indices, counts, hashes)
+
+    def save(self, path):
+        """Write the index into a snapshot version directory"""
+        for name in TFIDF_FILES:
+            np.save(os.path.join(path, f'tfidf.{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, TERMS_FILE), 'w') as f:
+            json.dump(self.terms, f)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map an index saved in a snapshot version directory, None if it has none"""
+        if not os.path.exists(os.path.join(path, TERMS_FILE)):
+            return None
+        with open(os.path.join(path, TERMS_FILE)) as f:
+            terms = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f'tfidf.{name}.npy'), mmap_mode='r')
+            for name in TFIDF_FILES
+        }
+        return cls(terms, **arrays)
+
+    def similarity(self, positions):
+        """Cosine similarity of every row to the centroid of the given rows"""
+        if len(positions) == 0:
+            return np.zeros(self.size)
+        centroid = np.asarray(self.matrix[positions].sum(axis=0), dtype=np.float64).ravel()
+        norm = np.linalg.norm(centroid)
+        if norm == 0:
+            return np.zeros(self.size)
+        return self.matrix @ (centroid / norm)